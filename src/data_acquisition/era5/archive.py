@@ -0,0 +1,112 @@
+import glob
+import os
+import re
+import numpy as np
+import netCDF4
+import cluster
+import def_hour
+import extract
+# one site's monthly files read as a single series along valid_time
+# data/nc/<site>/<prod>/<site>_YYYYMM_<prod>_h.nc from def_hour.py (or any '{ym}' file pattern):
+# files are found by name, opened only for the months asked for, and only the hours
+# in range of the cells asked for are read, in windows of hours that keep a read within a memory budget
+CACHE = 1 << 20 # HDF5 chunk cache per variable while streaming [bytes]: a window reads each chunk once,
+# and the netCDF default (64 MB per variable) held 450 MB for the 8 surface variables, far above the budget
+
+def layout(site,prods=('flx','sfc'),base=None): # file patterns of def_hour.target, {ym} for YYYYMM
+    return [os.path.join(base or def_hour.BASE_DIR, site, prod, f'{site}_{{ym}}_{prod}_h.nc') for prod in prods]
+
+def boxes(df,site,base=None): # {box: indices of df} from the clusters.csv of cluster.py, site for the sites not in it
+    name = df['site'].astype(str)
+    if not os.path.exists(os.path.join(base or def_hour.BASE_DIR, cluster.MAPPING)): return {site: np.arange(len(df))}
+    of = {str(k): v for k, v in cluster.load(base).items()}
+    box = name.map(of).fillna(site).values
+    return {b: np.flatnonzero(box == b) for b in sorted(set(box))}
+
+def epoch(x): # 'YYYY-MM[-DD[THH]]' or datetime64 -> epoch hours, ints pass through
+    if x is None or isinstance(x, (int, np.integer)): return x
+    return int((np.datetime64(x, 'h') - np.datetime64('1970-01-01T00', 'h')).astype(np.int64))
+
+def bounds(ym): # epoch hours of the first hour of month YYYYMM and of the next month
+    m = np.datetime64(f'{ym[:4]}-{ym[4:]}', 'M')
+    return epoch(m), epoch(m + 1)
+
+class Archive: # the products of one site, a variable is read from whichever product file holds it
+    def __init__(self, pattern):
+        self.pattern = [pattern] if isinstance(pattern, str) else list(pattern)
+        found = [self.scan(p) for p in self.pattern]
+        self.months = sorted(set.intersection(*found)) if found else [] # months every product has
+
+    @staticmethod
+    def scan(pattern): # YYYYMM of the files on disk
+        rx = re.compile(re.escape(pattern).replace(re.escape('{ym}'), r'(\d{6})') + '$')
+        return {m.group(1) for m in map(rx.match, glob.glob(pattern.replace('{ym}', '[0-9]' * 6))) if m}
+
+    def files(self, ym):
+        return [p.format(ym=ym) for p in self.pattern]
+
+    def span(self, start=None, end=None): # months overlapping [start, end)
+        s, e = epoch(start), epoch(end)
+        return [ym for ym in self.months if (s is None or bounds(ym)[1] > s) and (e is None or bounds(ym)[0] < e)]
+
+    def index(self, sites, ym=None): # site cells (extract.index) on the grid of a month
+        with netCDF4.Dataset(self.files(ym or self.months[0])[0]) as nc:
+            return extract.index(nc, sites)
+
+    def stream(self, ym, names, sites, act=None, method=extract.METHOD, start=None, end=None, budget=extract.BUDGET):
+        # -> (epoch hours, {name: (time, [level,] site)}) of one month within [start, end), in windows of hours
+        # short enough that the values read at a time stay within budget bytes
+        act = np.arange(len(sites)) if act is None else act
+        s, e = epoch(start), epoch(end)
+        ncs = [netCDF4.Dataset(fn) for fn in self.files(ym)]
+        try:
+            t, first, todo, got = None, [], [], set()
+            for fn, nc in zip(self.files(ym), ncs):
+                tt = extract.hours(nc)
+                if t is None:
+                    keep = np.ones(len(tt), dtype=bool)
+                    if s is not None: keep &= tt >= s
+                    if e is not None: keep &= tt < e
+                    t = tt[keep]
+                if len(t) == 0: return
+                j = np.searchsorted(tt, t)
+                if j[-1] >= len(tt) or (tt[j] != t).any() or j[-1] - j[0] + 1 != len(t):
+                    raise ValueError(f'{fn}: valid_time differs from {self.files(ym)[0]}')
+                todo.append([k for k in names if k in nc.variables and k not in got])
+                for k in todo[-1]: nc[k].set_var_chunk_cache(size=CACHE)
+                got.update(todo[-1])
+                first.append(j[0])
+            miss = [k for k in names if k not in got]
+            if miss: raise KeyError(f'{ym}: no {",".join(miss)} in ' + ' '.join(self.files(ym)))
+            c = sum(extract.cost(nc, k, sites, act, method) for nc, k in zip(ncs, todo) if k)
+            for w in extract.hourly(len(t), c, budget):
+                v = {}
+                for nc, j0, k in zip(ncs, first, todo):
+                    v.update(extract.sample(nc, k, sites, act, method, slice(j0 + w.start, j0 + w.stop)))
+                yield t[w], v
+        finally:
+            for nc in ncs: nc.close()
+
+    def month(self, ym, names, sites, act=None, method=extract.METHOD, start=None, end=None):
+        # -> epoch hours, {name: (time, [level,] site)} of one month within [start, end)
+        out = list(self.stream(ym, names, sites, act, method, start, end, np.inf))
+        if not out: return np.zeros(0, dtype=np.int64), {}
+        return np.concatenate([t for t, v in out]), {k: np.concatenate([v[k] for t, v in out]) for k in names}
+
+    def mean(self, ym, names, sites, act=None, method=extract.METHOD, budget=extract.BUDGET):
+        # -> hours read, {name: ([level,] site)} means over one month, summed window by window
+        n, tot = 0, {k: 0 for k in names}
+        for t, v in self.stream(ym, names, sites, act, method, budget=budget):
+            n += len(t)
+            for k in names: tot[k] = tot[k] + v[k].sum(axis=0)
+        return n, {k: tot[k] / max(n, 1) for k in names}
+
+    def read(self, names, sites, act=None, method=extract.METHOD, start=None, end=None): # whole range as one series
+        ts, out = [], {k: [] for k in names}
+        for ym in self.span(start, end):
+            t, v = self.month(ym, names, sites, act, method, start, end)
+            if len(t) == 0: continue
+            ts.append(t)
+            for k in names: out[k].append(v[k])
+        if not ts: raise FileNotFoundError('no months in range: ' + ' '.join(self.pattern))
+        return np.concatenate(ts), {k: np.concatenate(out[k]) for k in names}
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import urllib.parse
+import cds
+import def_hour
+import download
+import metrics
+from ledger import Ledger, phash
+from sched_hour import LEDGER, USER_CAP, finish, label, reattach, todo
+# asyncio engine for many outstanding CDS jobs: one event loop submits, polls and
+# streams all of them over one shared aiohttp session instead of a thread per request
+# same jobs, cache and ledger as sched_hour
+
+class Client: # CDS retrieve API over aiohttp, use as "async with Client() as client"
+    def __init__(self, url=None, key=None, timeout=60):
+        self.url, self.key = cds.config(url, key)
+        self.url = self.url.rstrip('/')
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+        self.session = aiohttp.ClientSession(headers={'PRIVATE-TOKEN': self.key},
+                                             timeout=aiohttp.ClientTimeout(sock_read=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def json(self, method, path, **kw):
+        async with self.session.request(method, self.url + path, **kw) as r:
+            r.raise_for_status()
+            return await r.json()
+
+    async def submit(self, dataset, request): # returns the remote job ID
+        reply = await self.json('POST', f'/retrieve/v1/processes/{dataset}/execution', json={'inputs': request})
+        return reply['jobID']
+
+    async def status(self, jid):
+        try:
+            return (await self.json('GET', f'/retrieve/v1/jobs/{jid}'))['status']
+        except Exception as e:
+            if getattr(e, 'status', None) == 404: return 'dismissed'
+            raise
+
+    async def download(self, jid, target): # stream the result to target, resuming dropped transfers
+        asset = (await self.json('GET', f'/retrieve/v1/jobs/{jid}/results'))['asset']['value']
+        href = urllib.parse.urljoin(self.url + '/', asset['href'])
+        return await download.aget(self.session, href, target, asset.get('file:size'), asset.get('file:checksum'))
+
+async def wait(client,jid,poll=cds.POLL,timer=None): # sleep in the loop until the job leaves the queue
+    state = await client.status(jid)
+    if timer: timer.seen(state)
+    while state in cds.PENDING:
+        await asyncio.sleep(poll)
+        state = await client.status(jid)
+        if timer: timer.seen(state)
+    return state
+
+async def fetch(job,client,book,slots,poll=cds.POLL):
+    out = [p[4] for p in job['parts']]
+    job = await asyncio.to_thread(todo, job) # netcdf headers are read off the loop
+    if job is None: return out
+    site, prods, iy, im = label(job)
+    dataset, request, fn = job['dataset'], job['request'], job['target']
+    h = phash(dataset, request, fn)
+    row = book.get(h)
+    log = os.path.join(def_hour.BASE_DIR, metrics.LOG)
+    async with slots:
+        jid, timer = None, metrics.Timer()
+        if row is not None and row['state'] == 'submitted' and reattach(await client.status(row['jid'])):
+            jid = row['jid']
+            timer.mark('submitted', row['updated']) # when the ledger recorded the submission, before the restart
+            print('reattach',site,prods,iy,f'{im:02d}',jid)
+        if jid is None:
+            print(site,prods,iy,f'{im:02d}')
+            jid = await client.submit(dataset, request)
+            book.put(h,site,prods,iy,im,jid,'submitted',fn)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        again = jid == (row or {}).get('jid')
+        try:
+            state = await wait(client, jid, poll, timer)
+            if state != 'successful': raise RuntimeError(f'CDS job {jid} {state}')
+            timer.mark('download')
+            await client.download(jid, fn)
+            timer.mark('downloaded'); timer.mark('bytes', os.path.getsize(fn))
+            await asyncio.to_thread(finish, job)
+        except Exception:
+            book.put(h,site,prods,iy,im,jid,'failed',fn)
+            metrics.record(log,timer,site,prods,iy,im,jid,'failed',again)
+            raise
+        book.put(h,site,prods,iy,im,jid,'completed',fn)
+        metrics.record(log,timer,site,prods,iy,im,jid,'successful',again)
+    return out
+
+async def arun(jobs,nw=USER_CAP,client=None,db=None,poll=cds.POLL):
+    if db is None:
+        os.makedirs(def_hour.BASE_DIR, exist_ok=True)
+        db = os.path.join(def_hour.BASE_DIR, LEDGER)
+    book = Ledger(db)
+    slots = asyncio.Semaphore(nw) # jobs outstanding at CDS
+    async with (client or Client()) as client:
+        res = await asyncio.gather(*[fetch(job,client,book,slots,poll) for job in jobs], return_exceptions=True)
+    book.close()
+    done, failed = [], []
+    for job, r in zip(jobs, res):
+        if isinstance(r, BaseException):
+            print('failed', *label(job), r)
+            failed.append(label(job))
+        else:
+            done += r
+    return done, failed
+
+def run(jobs,nw=USER_CAP,client=None,db=None,poll=cds.POLL): # nw: jobs outstanding at once (not clipped)
+    return asyncio.run(arun(jobs,nw,client,db,poll))
@@ -0,0 +1,40 @@
+import glob
+import hashlib
+import os
+import tempfile
+import time
+import async_hour
+import cds
+import def_hour
+import download
+import fake_cds
+import sched_hour
+# offline check of the resumable downloads: the sync engine (sched_hour + cds.Client on
+# ecmwf.datastores, which calls download.get) and the asyncio engine (download.aget) fetch
+# through a fake CDS server that cuts every result drop bytes in, drops times, and every
+# month file must come out with the size and md5 of the result the server sent
+
+site = 'bench'
+syr, eyr = 2000, 2000
+drop, drops = 4096, 2 # bytes sent before a disconnect, disconnects per result
+download.WAIT = 0.05 # seconds before the first resume
+
+def md5(fn):
+    with open(fn, 'rb') as f: return hashlib.md5(f.read()).hexdigest()
+
+for engine in ('sync', 'async'):
+    def_hour.BASE_DIR = tempfile.mkdtemp() # fresh ledger and files for every run
+    fake = fake_cds.Client(queue=0.2, work=0.1, key=f'bench-{engine}', poll=0.05)
+    server = fake_cds.serve(fake, drop=drop, drops=drops)
+    t0 = time.time()
+    jl = sched_hour.jobs(site, ['flx','sfc'], syr, eyr)
+    if engine == 'sync':
+        done, failed = sched_hour.run(jl, sched_hour.USER_CAP, cds.Client(server.url, fake.key), poll=0.05)
+    else:
+        done, failed = async_hour.run(jl, sched_hour.USER_CAP, async_hour.Client(server.url, fake.key), poll=0.05)
+    sent = {(os.path.getsize(fn), md5(fn)) for fn in server.files.values()}
+    got = {(os.path.getsize(fn), md5(fn)) for fn in glob.glob(os.path.join(def_hour.BASE_DIR, site, '*', '*.nc'))}
+    cuts = sum(server.cut.values())
+    ok = 'ok' if not failed and len(got) == len(sent) == len(done) and got == sent and cuts == drops * len(sent) else 'FAILED'
+    print(f'{engine}: months={len(done)} failed={len(failed)} disconnects={cuts} files={len(got)}/{len(sent)} {time.time()-t0:.1f}s {ok}')
+    server.shutdown()
@@ -0,0 +1,24 @@
+import tempfile
+import time
+import def_hour
+import fake_cds
+import plan_hour
+from sched_hour import *
+# offline benchmark of the scheduler against the fake CDS client
+
+site = 'bench'
+syr, eyr = 2000, 2000
+queue, work = 0.5, 0.1 # seconds in queue / processing per month
+
+for nw in (1,2,USER_CAP):
+    def_hour.BASE_DIR = tempfile.mkdtemp() # fresh ledger for every run
+    client = fake_cds.Client(queue=queue, work=work, key=f'bench{nw}')
+    t0 = time.time()
+    done, failed = run(jobs(site,['flx','sfc'],syr,eyr), nw, client, poll=client.poll)
+    print(f'nw={nw} months={len(done)} failed={len(failed)} peak={client.peak} {time.time()-t0:.2f}s')
+
+def_hour.BASE_DIR = tempfile.mkdtemp() # coalesced flx + sfc
+client = fake_cds.Client(queue=queue, work=work, key='plan')
+t0 = time.time()
+done, failed = run(plan_hour.plan(site,['flx','sfc'],syr,eyr), USER_CAP, client, poll=client.poll)
+print(f'coalesced jobs={len(client.calls)} months={len(done)} failed={len(failed)} {time.time()-t0:.2f}s')
@@ -0,0 +1,161 @@
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import netCDF4
+import archive
+import cache
+import def_hour
+import extract
+import fake_cds
+# memory benchmark of the windowed extraction (archive.Archive.stream) on a synthetic
+# pressure-level month of the HMA box of fujita_2/def_hour.py (55-25N, 65-105E, 20 levels)
+# every budget is read in a fresh process, whose peak RSS above its state just before
+# the read must stay within the budget; "python bench_stream.py [hours] [sites]"
+# then met_share_hour.py runs with nw processes on six synthetic surface months, and the RSS
+# of the whole process tree, sampled from /proc, must stay within about nw x (budget + 3 months of rows)
+
+latn, lats, lonw, lone = 55, 25, 65, 105 # HMA
+ym = '200001'
+budgets = [16 << 20, 64 << 20, 256 << 20, np.inf] # np.inf: the whole month at once
+
+def make(fn,nt): # synthetic pl month written an hour at a time, chunked as maps like CDS
+    lat = np.arange(latn, lats - fake_cds.GRID / 2, -fake_cds.GRID)
+    lon = np.arange(lonw, lone + fake_cds.GRID / 2, fake_cds.GRID)
+    lev = np.array(sorted(map(float, def_hour.LEVEL), reverse=True))
+    h = fake_cds.standard_height(lev)[:,None,None]
+    rnd = np.random.default_rng(0)
+    with netCDF4.Dataset(fn, 'w') as nc:
+        nc.createDimension('valid_time', nt)
+        v = nc.createVariable('valid_time', 'i8', ('valid_time',))
+        v.units = 'seconds since 1970-01-01'; v.calendar = 'proleptic_gregorian'
+        v[:] = archive.bounds(ym)[0] * 3600 + np.arange(nt) * 3600
+        for k, x in (('pressure_level', lev), ('latitude', lat), ('longitude', lon)):
+            nc.createDimension(k, len(x)); nc.createVariable(k, 'f8', (k,))[:] = x
+        dims = ('valid_time', 'pressure_level', 'latitude', 'longitude')
+        shape = (len(lev), len(lat), len(lon))
+        z = nc.createVariable('z', 'f4', dims, zlib=True, complevel=1, chunksizes=(1, 1) + shape[1:])
+        t = nc.createVariable('t', 'f4', dims, zlib=True, complevel=1, chunksizes=(1, 1) + shape[1:])
+        for i in range(nt):
+            z[i] = h * extract.G + rnd.standard_normal(shape)
+            t[i] = 288.15 - 0.0065 * h + rnd.standard_normal(shape)
+
+def single(fn,prod,ym): # synthetic single-level month of prod, chunked as maps like CDS
+    lat = np.arange(latn, lats - fake_cds.GRID / 2, -fake_cds.GRID)
+    lon = np.arange(lonw, lone + fake_cds.GRID / 2, fake_cds.GRID)
+    t0, t1 = archive.bounds(ym)
+    rnd = np.random.default_rng(t0)
+    with netCDF4.Dataset(fn, 'w') as nc:
+        nc.createDimension('valid_time', t1 - t0)
+        v = nc.createVariable('valid_time', 'i8', ('valid_time',))
+        v.units = 'seconds since 1970-01-01'; v.calendar = 'proleptic_gregorian'
+        v[:] = np.arange(t0, t1) * 3600
+        for k, x in (('latitude', lat), ('longitude', lon)):
+            nc.createDimension(k, len(x)); nc.createVariable(k, 'f8', (k,))[:] = x
+        shape = (len(lat), len(lon))
+        for name in def_hour.VARIABLE[prod]:
+            k = cache.NAME[name]
+            w = nc.createVariable(k, 'f4', ('valid_time', 'latitude', 'longitude'), zlib=True, complevel=1, chunksizes=(1,) + shape)
+            for i in range(t1 - t0): w[i] = fake_cds.BASE[k] * (1 + 0.01 * rnd.standard_normal(shape))
+
+def sites(n): # sites spread over the box, so the block read covers most of the grid
+    rnd = np.random.default_rng(1)
+    return pd.DataFrame({'site': [f's{i}' for i in range(n)], 'lon': rnd.uniform(lonw, lone, n),
+        'lat': rnd.uniform(lats, latn, n), 'elv': rnd.uniform(0, 5000, n)})
+
+def tree(pid): # proportional resident bytes (pages shared after fork counted once) of a process and its descendants, Linux /proc
+    kids, total = {}, 0
+    for d in os.listdir('/proc'):
+        if not d.isdigit(): continue
+        try:
+            with open(f'/proc/{d}/stat') as f: ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            kids.setdefault(ppid, []).append(int(d))
+        except (OSError, IndexError, ValueError): pass
+    todo = [pid]
+    while todo:
+        p = todo.pop()
+        todo += kids.get(p, [])
+        try:
+            with open(f'/proc/{p}/smaps_rollup') as f: total += sum(int(x.split()[1]) << 10 for x in f if x.startswith('Pss:'))
+        except OSError: pass
+    return total
+
+def idle(env): # bytes of an interpreter that has imported the extractor's modules
+    p = subprocess.Popen([sys.executable, '-c', 'import sys, archive, extract; print(); sys.stdin.read()'], env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    p.stdout.readline()
+    b = tree(p.pid)
+    p.communicate('')
+    return b
+
+def script(d,n,nw,budget,nm=6): # met_share_hour.py on nm synthetic months (more than the nw + 1 held) -> peak tree RSS, bytes of a month of rows
+    df = sites(n)
+    df['syr'], df['eyr'] = 2000, 2000
+    df.to_csv(os.path.join(d, 'site.ini'), index=False)
+    with netCDF4.Dataset(os.path.join(d, 'surface_geopotential.nc'), 'w') as nc: # flat ERA5 surface
+        for k, x in (('latitude', np.arange(90, -90.1, -fake_cds.GRID)), ('longitude', np.arange(0, 360, fake_cds.GRID))):
+            nc.createDimension(k, len(x)); nc.createVariable(k, 'f8', (k,))[:] = x
+        nc.createVariable('z', 'f4', ('latitude', 'longitude'), zlib=True)[:] = 0
+    for prod in ('flx', 'sfc'):
+        for im in range(1, nm + 1):
+            fn = os.path.join(d, def_hour.target('bench', prod, 2000, im))
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            single(fn, prod, f'2000{im:02d}')
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'met_share_hour.py')) as f: code = f.read()
+    for k, v in (('site', "'bench'"), ('syr', '2000'), ('eyr', '2000'), ('nm', str(nm)), ('nw', str(nw)), ('budget', str(budget))):
+        code = re.sub(rf'^{k} = .*$', f'{k} = {v}', code, count=1, flags=re.M) # the settings a user edits
+    with open(os.path.join(d, 'met_share_hour.py'), 'w') as f: f.write(code)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    p = subprocess.Popen([sys.executable, 'met_share_hour.py'], cwd=d, env=env, stdout=subprocess.DEVNULL)
+    peak = 0
+    while p.poll() is None:
+        peak = max(peak, tree(p.pid))
+        time.sleep(0.02)
+    if p.returncode: sys.exit(f'met_share_hour.py failed ({p.returncode})')
+    return peak, idle(env), n * 24 * 31 * len(extract.MET) * 8
+
+def run(path,budget,n): # in the child: stream the month and report peak RSS above the start [bytes]
+    os.chdir(os.path.dirname(path)) # grid_index/ cache in the temporary directory
+    df = sites(n)
+    arc = archive.Archive(path)
+    with netCDF4.Dataset(arc.files(ym)[0]) as nc:
+        plev = nc['pressure_level'][:]
+        c = extract.cost(nc, ['z','t'], df, np.arange(n))
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    t0, nw = time.time(), 0
+    for t, v in arc.stream(ym, ['z','t'], df, budget=budget):
+        extract.bracket(v['z'], v['t'], plev, df['elv'].values)
+        nw += 1
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(nw, c, peak - base, time.time() - t0)
+
+if len(sys.argv) > 1 and sys.argv[1] == 'run':
+    run(sys.argv[2], float(sys.argv[3]), int(sys.argv[4]))
+    sys.exit()
+
+nt = int(sys.argv[1]) if len(sys.argv) > 1 else 24 * 7
+n = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, 'hma{ym}pl.nc')
+    t0 = time.time()
+    make(path.format(ym=ym), nt)
+    print(f'{nt} hours x 20 levels x 121 x 161: {os.path.getsize(path.format(ym=ym)) / 1e6:.0f} MB on disk ({time.time()-t0:.1f}s)')
+    for budget in budgets:
+        out = subprocess.run([sys.executable, __file__, 'run', path, str(budget), str(n)], capture_output=True, text=True, check=True)
+        nw, c, rss, sec = out.stdout.split()
+        rss = int(rss)
+        ok = 'ok' if budget == np.inf or rss <= budget else 'OVER'
+        print(f'budget={budget / 2**20:.0f}MB' if budget < np.inf else 'budget=none', f'windows={nw} read/hour={float(c) / 2**20:.1f}MB peak+={rss / 2**20:.0f}MB {float(sec):.1f}s {ok}')
+
+workers, budget = 4, 16 << 20
+with tempfile.TemporaryDirectory() as d:
+    t0 = time.time()
+    peak, base, rows = script(d, n, workers, budget)
+    bound = (workers + 1) * base + workers * (budget + 3 * rows) + 2 * (workers + 1) * rows # workers: read, gathered, pickled; parent: months held
+    ok = 'ok' if peak <= bound else 'OVER'
+    print(f'met_share_hour.py nw={workers} budget={budget / 2**20:.0f}MB sites={n}: month of rows={rows / 2**20:.0f}MB tree peak={peak / 2**20:.0f}MB bound={bound / 2**20:.0f}MB {time.time()-t0:.1f}s {ok}')
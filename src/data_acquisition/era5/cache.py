@@ -0,0 +1,128 @@
+import calendar
+import datetime
+import hashlib
+import json
+import os
+import threading
+# content-aware check of downloaded month files before a request is submitted
+# manifest.json (under BASE_DIR) keeps size, mtime and sha256 of every good file,
+# so an unchanged file is accepted with one stat() call
+# a month that is complete up to an earlier day is topped up rather than fetched again
+MANIFEST = 'manifest.json'
+LATENCY = 5 # days ERA5 lags real time
+NAME = { # CDS variable -> netcdf name
+    "total_precipitation": 'tp',
+    "surface_solar_radiation_downwards": 'ssrd',
+    "surface_thermal_radiation_downwards": 'strd',
+    "10m_u_component_of_wind": 'u10',
+    "10m_v_component_of_wind": 'v10',
+    "2m_dewpoint_temperature": 'd2m',
+    "2m_temperature": 't2m',
+    "surface_pressure": 'sp',
+    "geopotential": 'z',
+    "temperature": 't'
+}
+_lock = threading.Lock()
+_books = {}
+nclock = threading.Lock() # the HDF5 library behind netCDF4 is not thread safe
+
+def horizon(): # last day published at CDS
+    return datetime.date.today() - datetime.timedelta(days=LATENCY)
+
+def nday(iy,im): # days of a month available at CDS (0 for the future)
+    last = horizon()
+    if (iy,im) < (last.year,last.month): return calendar.monthrange(iy,im)[1]
+    if (iy,im) == (last.year,last.month): return last.day
+    return 0
+
+def nhour(iy,im): # expected length of valid_time for a month
+    return nday(iy,im) * 24
+
+def sha256(fn):
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for b in iter(lambda: f.read(1 << 20), b''): h.update(b)
+    return h.hexdigest()
+
+def hpa(level): # requested pressure levels as sorted floats, None for the surface products
+    return None if level is None else sorted(float(lev) for lev in level)
+
+def check(fn,variable,area,level=None): # ('' or the reason the header is not as requested, hours in the file)
+    import netCDF4
+    latn, lonw, lats, lone = area
+    try:
+        with nclock, netCDF4.Dataset(fn) as nc:
+            miss = [NAME[v] for v in variable if NAME[v] not in nc.variables]
+            if miss: return 'missing ' + ','.join(miss), 0
+            lat, lon = nc['latitude'][:], nc['longitude'][:]
+            if abs(lat.max() - latn) > 1e-3 or abs(lat.min() - lats) > 1e-3: return 'latitude range', 0
+            if abs(lon.min() - lonw) > 1e-3 or abs(lon.max() - lone) > 1e-3: return 'longitude range', 0
+            if level is not None and ('pressure_level' not in nc.variables or sorted(map(float, nc['pressure_level'][:])) != hpa(level)):
+                return 'pressure_level', 0 # e.g. a band of pl_band.py narrower than the sites now need
+            return '', len(nc['valid_time'])
+    except (OSError, KeyError, IndexError) as e:
+        return f'unreadable ({e})', 0
+
+class Manifest:
+    def __init__(self, base):
+        self.base = base
+        self.path = os.path.join(base, MANIFEST)
+        self.files = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f: self.files = json.load(f)
+
+    def key(self, fn):
+        return os.path.relpath(fn, self.base)
+
+    def fresh(self, fn, nt, level=None): # O(1): file unchanged since it was validated with nt hours or more and these levels
+        e = self.files.get(self.key(fn))
+        if e is None or e['nt'] < nt or e.get('level') != hpa(level) or not os.path.exists(fn): return False
+        st = os.stat(fn)
+        return e['size'] == st.st_size and e['mtime'] == st.st_mtime_ns
+
+    def record(self, fn, nt, level=None):
+        st = os.stat(fn)
+        e = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': sha256(fn), 'nt': nt, 'level': hpa(level)}
+        with _lock:
+            self.files[self.key(fn)] = e
+            self.save()
+
+    def drop(self, fn):
+        with _lock:
+            if self.files.pop(self.key(fn), None) is not None: self.save()
+
+    def verify(self, fn): # full checksum comparison (slow, reads the file)
+        e = self.files.get(self.key(fn))
+        return e is not None and os.path.exists(fn) and sha256(fn) == e['sha256']
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f: json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+def manifest(base): # one manifest per BASE_DIR, shared by all threads
+    with _lock:
+        if base not in _books: _books[base] = Manifest(base)
+        return _books[base]
+
+def state(book,fn,variable,nt,area,level=None):
+    # skip: good copy, repair: good copy re-recorded, topup: good copy missing the tail days, fetch: (re)download
+    if not os.path.exists(fn):
+        book.drop(fn)
+        return 'fetch'
+    if book.fresh(fn,nt,level): return 'skip'
+    why, n = check(fn,variable,area,level)
+    if not why and 0 < n < nt and n % 24 == 0: return 'topup'
+    if not why and n < nt: why = f'valid_time {n} < {nt}' # more hours than nhour: CDS published past the horizon, keep them
+    if why: # kept until the new download replaces it (download.py: <target>.part, then os.replace)
+        print('invalid', fn, why)
+        book.drop(fn)
+        return 'fetch'
+    book.record(fn,n,level)
+    return 'repair'
+
+def accept(book,fn,variable,nt,area,level=None): # validate a new download and record it
+    why, n = check(fn,variable,area,level)
+    if not why and n < nt: why = f'valid_time {n} < {nt}'
+    if why: raise RuntimeError(f'bad download {fn}: {why}')
+    book.record(fn,n,level)
@@ -0,0 +1,57 @@
+import os
+import time
+# submit / poll / download interface to CDS, so that job IDs can be kept and reattached
+# uses ecmwf-datastores-client, which comes with cdsapi>=0.7.6
+POLL = 30 # seconds between status checks
+PENDING = ('accepted', 'running') # job still queued or running remotely
+RC = '~/.cdsapirc' # url: and key: lines, as for cdsapi
+
+def config(url=None, key=None): # (url, key) from the arguments, CDSAPI_URL/CDSAPI_KEY or ~/.cdsapirc
+    url, key = url or os.environ.get('CDSAPI_URL'), key or os.environ.get('CDSAPI_KEY')
+    rc = os.path.expanduser(os.environ.get('CDSAPI_RC', RC))
+    if (url is None or key is None) and os.path.exists(rc):
+        with open(rc) as f:
+            conf = dict(line.strip().split(':', 1) for line in f if ':' in line)
+        url, key = url or conf.get('url', '').strip(), key or conf.get('key', '').strip()
+    return url, key
+
+class Client:
+    def __init__(self, url=None, key=None):
+        from ecmwf.datastores import Client
+        self.api = Client(url=url, key=key, progress=False)
+        self.key = self.api.key
+
+    def submit(self, dataset, request): # returns the remote job ID
+        return self.api.submit(dataset, request).request_id
+
+    def status(self, jid): # accepted, running, successful, failed, rejected
+        return self.api.get_remote(jid).status
+
+    def download(self, jid, target): # resumable, see download.py
+        import download
+        results = self.api.get_results(jid)
+        asset = results.asset
+        return download.get(results.location, target, asset.get('file:size'), asset.get('file:checksum'),
+                            self.api.session)
+
+    def retrieve(self, dataset, request, target): # same call as cdsapi.Client.retrieve
+        return wait_download(self, self.submit(dataset, request), target)
+
+def wait(client, jid, poll=POLL, timer=None): # block until the job leaves the queue, returns final state
+    state = client.status(jid)
+    if timer: timer.seen(state)
+    while state in PENDING:
+        time.sleep(poll)
+        state = client.status(jid)
+        if timer: timer.seen(state)
+    return state
+
+def wait_download(client, jid, target, poll=POLL, timer=None): # timer: metrics.Timer
+    state = wait(client, jid, poll, timer)
+    if state != 'successful': raise RuntimeError(f'CDS job {jid} {state}')
+    if timer: timer.mark('download')
+    client.download(jid, target)
+    if timer:
+        timer.mark('downloaded')
+        timer.mark('bytes', os.path.getsize(target))
+    return target
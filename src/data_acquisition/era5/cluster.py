@@ -0,0 +1,70 @@
+import heapq
+import math
+import os
+import numpy as np
+import pandas as pd
+import def_hour
+# group the sites of site.ini into a few tight boxes on the ERA5 0.25 deg grid
+# every box is requested as its own 'site' (data/nc/<box>/<prod>/...) and
+# BASE_DIR/clusters.csv records which box holds which site
+# boxes do not cross +-180 deg (the regional files are -180->180): sites on either side stay in separate boxes
+GRID = 0.25 # ERA5 grid [deg]
+WASTE = 16 # extra grid cells accepted to save one request
+MAPPING = 'clusters.csv'
+
+def cell(lon,lat): # box of the grid points around a site: [north, west, south, east]
+    lon = lon - 360 if lon > 180 else lon # -180->180 as the regional files
+    return [math.ceil(lat / GRID) * GRID, math.floor(lon / GRID) * GRID,
+            math.floor(lat / GRID) * GRID, math.ceil(lon / GRID) * GRID]
+
+def union(a,b):
+    return [max(a[0],b[0]), min(a[1],b[1]), min(a[2],b[2]), max(a[3],b[3])]
+
+def ncell(a): # grid points in a box, or in each row of an array of boxes
+    a = np.asarray(a, dtype=float)
+    return (np.round((a[...,0] - a[...,2]) / GRID) + 1) * (np.round((a[...,3] - a[...,1]) / GRID) + 1)
+
+def group(df,waste=WASTE): # [(box, [site index])], merging the cheapest pair while it wastes <= waste cells
+    # a heap of the pairs that waste <= waste cells; after a merge only the pairs of the merged box are
+    # costed again (one numpy pass over the boxes), so n sites take O(n^2) arithmetic rather than O(n^3)
+    # ties go to the first pair in site order, as a full rescan would pick them
+    box = np.array([cell(lon,lat) for lon, lat in zip(df['lon'], df['lat'])], dtype=float).reshape(-1, 4)
+    members = [[i] for i in range(len(box))]
+    alive = np.ones(len(box), dtype=bool)
+    ver = np.zeros(len(box), dtype=int) # bumped when a box grows, older heap entries are stale
+    def costs(i): # cells wasted by merging box i with every box
+        u = np.column_stack([np.maximum(box[i,0], box[:,0]), np.minimum(box[i,1], box[:,1]),
+                             np.minimum(box[i,2], box[:,2]), np.maximum(box[i,3], box[:,3])])
+        return ncell(u) - ncell(box[i]) - ncell(box)
+    heap = []
+    def push(i,js):
+        c = costs(i)
+        for j in js[(c[js] <= waste) & alive[js]]:
+            a, b = min(i, j), max(i, j)
+            heapq.heappush(heap, (int(c[j]), a, b, ver[a], ver[b]))
+    for i in range(len(box)): push(i, np.arange(i + 1, len(box)))
+    while heap:
+        cost, i, j, vi, vj = heapq.heappop(heap)
+        if not (alive[i] and alive[j] and ver[i] == vi and ver[j] == vj): continue # stale
+        box[i] = union(box[i], box[j])
+        members[i] += members[j]
+        alive[j], ver[i] = False, ver[i] + 1
+        push(i, np.flatnonzero(alive & (np.arange(len(box)) != i)))
+    return [([float(x) for x in box[i]], members[i]) for i in np.flatnonzero(alive)]
+
+def plan(ini='site.ini',prefix='box',waste=WASTE): # register the boxes in def_hour.AREA and write the mapping
+    df = pd.read_csv(ini)
+    rows = []
+    for k, (box, members) in enumerate(sorted(group(df,waste), key=lambda b: (-b[0][0], b[0][1]))):
+        name = f'{prefix}{k:02d}'
+        def_hour.AREA[name] = box
+        for i in members: rows.append([df['site'][i], name] + box)
+    out = pd.DataFrame(rows, columns=['site','box','latn','lonw','lats','lone'])
+    os.makedirs(def_hour.BASE_DIR, exist_ok=True)
+    out.to_csv(os.path.join(def_hour.BASE_DIR, MAPPING), index=False)
+    return sorted(set(out['box']))
+
+def load(base=None): # site -> box from the mapping, registering the boxes again
+    out = pd.read_csv(os.path.join(base or def_hour.BASE_DIR, MAPPING))
+    for r in out.itertuples(): def_hour.AREA[r.box] = [r.latn, r.lonw, r.lats, r.lone]
+    return dict(zip(out['site'], out['box']))
@@ -0,0 +1,124 @@
+import os
+import sys
+import numpy as np
+import netCDF4
+import archive
+import extract
+# one compressed netCDF per site and product holding all its months along an unlimited valid_time
+# data/cube/<site>/<site>_<prod>_h.nc, chunked as a month of hours over small tiles of cells
+# (the month files of CDS are chunked as maps), so a point series decompresses a chunk per month
+# a chunk is rewritten at most once by the next month's append: HDF5 does not reclaim the space of a
+# rewritten compressed chunk, so year chunks appended month by month came out 1.3-1.8x the size
+# "python cube.py <site> [prod ...]" adds the months of def_hour.py not yet in the cube
+CUBE = 'data/cube'
+TIME = 24 * 31 # hours per chunk
+TILE = 4 # cells per chunk side
+LEVEL = 4 # zlib level
+CACHE = 64 << 20 # chunk cache per variable [bytes]
+
+def target(site,prod,base=CUBE):
+    return os.path.join(base, site, f'{site}_{prod}_h.nc')
+
+def fields(nc): # gridded variables of a file
+    return [k for k, v in nc.variables.items() if v.dimensions[-2:] == ('latitude', 'longitude') and k not in nc.dimensions]
+
+def chunk(d,n): # chunk length along dimension d of size n
+    if d == 'valid_time': return TIME
+    if d in ('latitude', 'longitude'): return min(TILE, n)
+    return 1 # pressure_level: a level is written at a time
+
+def create(fn,src): # empty cube with the grid and the variables of the month file src
+    os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+    skip = ('_FillValue', 'scale_factor', 'add_offset', 'missing_value')
+    with netCDF4.Dataset(fn + '.tmp', 'w') as nc:
+        for d, dim in src.dimensions.items():
+            nc.createDimension(d, None if d == 'valid_time' else len(dim))
+        for k in list(src.dimensions) + fields(src):
+            if k not in src.variables: continue
+            v = src[k]
+            if k in src.dimensions:
+                w = nc.createVariable(k, v.dtype, v.dimensions)
+                if k != 'valid_time': w[:] = v[:]
+            else:
+                size = [chunk(d, len(src.dimensions[d])) for d in v.dimensions]
+                w = nc.createVariable(k, 'f4', v.dimensions, zlib=True, complevel=LEVEL, shuffle=True,
+                    chunksizes=size, fill_value=np.float32(np.nan))
+            w.setncatts({a: v.getncattr(a) for a in v.ncattrs() if a not in skip})
+    os.replace(fn + '.tmp', fn)
+
+def last(nc): # epoch hour of the end of a cube, None when empty
+    return int(extract.hours(nc, slice(-1, None))[0]) if len(nc['valid_time']) else None
+
+def append(fn,month): # write the hours of a month file that follow the cube, in place -> hours written
+    with netCDF4.Dataset(month) as src:
+        if not os.path.exists(fn): create(fn, src)
+        with netCDF4.Dataset(fn, 'a') as nc:
+            if extract.axes(nc) != extract.axes(src): raise ValueError(f'{month}: grid differs from {fn}')
+            names = fields(nc)
+            miss = [k for k in names if k not in src.variables]
+            if miss: raise KeyError(f'{month}: no {",".join(miss)} for {fn}')
+            t, e = extract.hours(src), last(nc)
+            new = np.ones(len(t), dtype=bool) if e is None else t > e
+            if not new.any(): return 0
+            j = np.flatnonzero(new)
+            if len(j) != j[-1] - j[0] + 1: raise ValueError(f'{month}: valid_time not sorted')
+            if j[0] > 0 and not np.isin(t[:j[0]], extract.hours(nc, slice(-j[0], None))).all():
+                raise ValueError(f'{month}: hours before the end of {fn} that it does not hold') # append only
+            it, n = slice(j[0], j[-1] + 1), len(nc['valid_time'])
+            nc['valid_time'][n:] = src['valid_time'][it]
+            for k in names:
+                w = nc[k]
+                w.set_var_chunk_cache(size=CACHE)
+                for lev in np.ndindex(w.shape[1:-2]): # whole maps, one level at a time
+                    w[(slice(n, n + len(j)),) + lev] = src[k][(it,) + lev]
+            return len(j)
+
+def held(fn): # epoch hours in a cube, empty when there is none
+    if not os.path.exists(fn): return np.zeros(0, dtype=np.int64)
+    with netCDF4.Dataset(fn) as nc: return extract.hours(nc)
+
+def repack(site,prod,base=CUBE): # add every month of def_hour.py on disk not yet in the cube
+    arc = archive.Archive(archive.layout(site, [prod]))
+    fn = target(site, prod, base)
+    t = held(fn)
+    for ym in arc.months:
+        with netCDF4.Dataset(arc.files(ym)[0]) as nc: new = np.setdiff1d(extract.hours(nc), t)
+        if len(new) == 0: continue # already in
+        if len(t) and new[0] < t[-1]: # a month retried or backfilled before the end: the cube is written again in order
+            print(fn, ym, 'not in the cube before its end, rebuilding')
+            return rebuild(fn, arc)
+        n = append(fn, arc.files(ym)[0])
+        print(fn, ym, n, 'hours')
+        t = held(fn)
+    gaps(fn, arc)
+    return fn
+
+def rebuild(fn,arc): # the cube of all months on disk, swapped in when complete
+    if os.path.exists(fn + '.new'): os.remove(fn + '.new')
+    for ym in arc.months:
+        n = append(fn + '.new', arc.files(ym)[0])
+        print(fn, ym, n, 'hours')
+    os.replace(fn + '.new', fn)
+    gaps(fn, arc)
+    return fn
+
+def gaps(fn,arc): # warn of the months missing on disk between the first and the last
+    if not arc.months: return
+    first, end = (np.datetime64(f'{ym[:4]}-{ym[4:]}') for ym in (arc.months[0], arc.months[-1]))
+    miss = [ym for ym in (str(m).replace('-', '') for m in np.arange(first, end)) if ym not in arc.months]
+    if miss: print(fn, 'gap: no month file for', *miss)
+
+def read(fn,names,sites,act=None,method=extract.METHOD,start=None,end=None): # as archive.Archive.read from a cube
+    act = np.arange(len(sites)) if act is None else act
+    s, e = archive.epoch(start), archive.epoch(end)
+    with netCDF4.Dataset(fn) as nc:
+        t = extract.hours(nc)
+        i0 = 0 if s is None else np.searchsorted(t, s)
+        i1 = len(t) if e is None else np.searchsorted(t, e)
+        for k in names: nc[k].set_var_chunk_cache(size=CACHE)
+        return t[i0:i1], extract.sample(nc, names, sites, act, method, slice(i0, i1))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2: sys.exit('usage: python cube.py <site> [prod ...]')
+    for prod in sys.argv[2:] or ['flx', 'sfc', 'pl']:
+        repack(sys.argv[1], prod)
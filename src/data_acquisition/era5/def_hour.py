@@ -1,156 +1,96 @@
-import cdsapi
 import os
+import cache
 # check pressure level (L133-) for the target domain
 latn, lats, lonw, lone = 43, 42.75, 144.25, 144.5 # for Lake Harutori
-BASE_DIR = 'data/nc' 
+BASE_DIR = 'data/nc'
+AREA = {} # site -> [north, west, south, east], for sites not using the box above (see cluster.py)
 
-def flx(site,iy,im):
-    yr = str(iy)
-    mn = f'{im:02d}'
-    print(site,yr,mn)
-    dataset = "reanalysis-era5-single-levels"
-    request = {
-        "product_type": ["reanalysis"],
-        "variable": [
-            "total_precipitation",
-            "surface_solar_radiation_downwards",
-            "surface_thermal_radiation_downwards"
-        ],
-        "year": yr,
-        "month": mn,
-        "day": [
-            "01", "02", "03",
-            "04", "05", "06",
-            "07", "08", "09",
-            "10", "11", "12",
-            "13", "14", "15",
-            "16", "17", "18",
-            "19", "20", "21",
-            "22", "23", "24",
-            "25", "26", "27",
-            "28", "29", "30",
-            "31"
-        ],
-        "time": [
-            "00:00", "01:00", "02:00",
-            "03:00", "04:00", "05:00",
-            "06:00", "07:00", "08:00",
-            "09:00", "10:00", "11:00",
-            "12:00", "13:00", "14:00",
-            "15:00", "16:00", "17:00",
-            "18:00", "19:00", "20:00",
-            "21:00", "22:00", "23:00"
-        ],
-        "data_format": "netcdf",
-        "download_format": "unarchived",
-        "area": [latn, lonw, lats, lone]
-    }
-    target_dir = os.path.join(BASE_DIR, site, 'flx')
-    target = os.path.join(target_dir, f'{site}_{yr}{mn}_flx_h.nc')
-    os.makedirs(target_dir, exist_ok=True) 
-    client = cdsapi.Client(delete = True)
-    client.retrieve(dataset, request, target)
+DATASET = {
+    'flx': "reanalysis-era5-single-levels",
+    'sfc': "reanalysis-era5-single-levels",
+    'pl': "reanalysis-era5-pressure-levels"
+}
+VARIABLE = {
+    'flx': [
+        "total_precipitation",
+        "surface_solar_radiation_downwards",
+        "surface_thermal_radiation_downwards"
+    ],
+    'sfc': [
+        "10m_u_component_of_wind",
+        "10m_v_component_of_wind",
+        "2m_dewpoint_temperature",
+        "2m_temperature",
+        "surface_pressure"
+    ],
+    'pl': [
+        "geopotential",
+        "temperature"
+    ]
+}
+DAY = [f'{d:02d}' for d in range(1,32,1)] # "01" .. "31"
+TIME = [f'{h:02d}:00' for h in range(0,24,1)] # "00:00" .. "23:00"
+LEVEL = [
+    "300", "350", "400",
+    "450", "500", "550",
+    "600", "650", "700",
+    "750", "775", "800",
+    "825", "850", "875",
+    "900", "925", "950",
+    "975", "1000"
+]
 
-def sfc(site,iy,im):
-    yr = str(iy)
-    mn = f'{im:02d}'
-    print(site,yr,mn)
-    dataset = "reanalysis-era5-single-levels"
-    request = {
-        "product_type": ["reanalysis"],
-        "variable": [
-            "10m_u_component_of_wind",
-            "10m_v_component_of_wind",
-            "2m_dewpoint_temperature",
-            "2m_temperature",
-            "surface_pressure"
-        ],
-        "year": yr,
-        "month": mn,
-        "day": [
-            "01", "02", "03",
-            "04", "05", "06",
-            "07", "08", "09",
-            "10", "11", "12",
-            "13", "14", "15",
-            "16", "17", "18",
-            "19", "20", "21",
-            "22", "23", "24",
-            "25", "26", "27",
-            "28", "29", "30",
-            "31"
-        ],
-        "time": [
-            "00:00", "01:00", "02:00",
-            "03:00", "04:00", "05:00",
-            "06:00", "07:00", "08:00",
-            "09:00", "10:00", "11:00",
-            "12:00", "13:00", "14:00",
-            "15:00", "16:00", "17:00",
-            "18:00", "19:00", "20:00",
-            "21:00", "22:00", "23:00"
-        ],
-        "data_format": "netcdf",
-        "download_format": "unarchived",
-        "area": [latn, lonw, lats, lone]
-    }
-    target_dir = os.path.join(BASE_DIR, site, 'sfc')
-    target = os.path.join(target_dir, f'{site}_{yr}{mn}_sfc_h.nc')
-    os.makedirs(target_dir, exist_ok=True) 
-    client = cdsapi.Client(delete = True)
-    client.retrieve(dataset, request, target)
+def area(site=None): # [north, west, south, east] as CDS expects
+    return AREA.get(site, [latn, lonw, lats, lone])
 
-def pl(site,iy,im):
-    yr = str(iy)
-    mn = f'{im:02d}'
-    print(site,yr,mn)
-    dataset = "reanalysis-era5-pressure-levels"
+def levels(prod): # pressure levels requested for prod, None for the surface products
+    return LEVEL if prod == 'pl' else None
+
+def request(prod,iy,im,d0=1,site=None): # CDS request of a product for the published days d0.. of a month
     request = {
         "product_type": ["reanalysis"],
-        "variable": [
-            "geopotential",
-            "temperature"
-        ],
-        "year": yr,
-        "month": mn,
-        "day": [
-            "01", "02", "03",
-            "04", "05", "06",
-            "07", "08", "09",
-            "10", "11", "12",
-            "13", "14", "15",
-            "16", "17", "18",
-            "19", "20", "21",
-            "22", "23", "24",
-            "25", "26", "27",
-            "28", "29", "30",
-            "31"
-        ],
-        "time": [
-            "00:00", "01:00", "02:00",
-            "03:00", "04:00", "05:00",
-            "06:00", "07:00", "08:00",
-            "09:00", "10:00", "11:00",
-            "12:00", "13:00", "14:00",
-            "15:00", "16:00", "17:00",
-            "18:00", "19:00", "20:00",
-            "21:00", "22:00", "23:00"
-        ],
-        "pressure_level": [
-            "300", "350", "400",
-            "450", "500", "550",
-            "600", "650", "700",
-            "750", "775", "800",
-            "825", "850", "875",
-            "900", "925", "950",
-            "975", "1000"
-        ],
+        "variable": VARIABLE[prod],
+        "year": str(iy),
+        "month": f'{im:02d}',
+        "day": DAY[d0-1:cache.nday(iy,im)],
+        "time": TIME,
         "data_format": "netcdf",
         "download_format": "unarchived",
-        "area": [latn, lonw, lats, lone]
+        "area": area(site)
     }
-    target_dir = os.path.join(BASE_DIR, site, 'pl')
-    target = os.path.join(target_dir, f'{site}_{yr}{mn}_pl_h.nc')
-    os.makedirs(target_dir, exist_ok=True) 
-    client = cdsapi.Client(delete = True)
-    client.retrieve(dataset, request, target)
+    if prod == 'pl': request["pressure_level"] = LEVEL
+    return request
+
+def target(site,prod,iy,im): # data/nc/<site>/<prod>/<site>_<YYYYMM>_<prod>_h.nc
+    return os.path.join(BASE_DIR, site, prod, f'{site}_{iy}{im:02d}_{prod}_h.nc')
+
+def get(site,prod,iy,im,client=None): # retrieve one month unless a valid copy exists, client is shared when given
+    fn = target(site,prod,iy,im)
+    book, nt = cache.manifest(BASE_DIR), cache.nhour(iy,im)
+    if nt == 0: return None # not published yet
+    state = cache.state(book,fn,VARIABLE[prod],nt,area(site),levels(prod))
+    if state not in ('fetch', 'topup'): return fn
+    print(site,str(iy),f'{im:02d}',state)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    if client is None:
+        import cdsapi
+        client = cdsapi.Client(delete = True)
+    if state == 'topup': # fetch the tail days only and append them
+        import plan_hour
+        job = plan_hour.topup(site,prod,iy,im)
+        client.retrieve(job['dataset'], job['request'], job['target'])
+        plan_hour.split(job)
+    else:
+        client.retrieve(DATASET[prod], request(prod,iy,im,site=site), fn + '.part') # the old file stays until this one is complete
+        os.replace(fn + '.part', fn)
+    cache.accept(book,fn,VARIABLE[prod],nt,area(site),levels(prod))
+    return fn
+
+def flx(site,iy,im,client=None):
+    return get(site,'flx',iy,im,client)
+
+def sfc(site,iy,im,client=None):
+    return get(site,'sfc',iy,im,client)
+
+def pl(site,iy,im,client=None):
+    return get(site,'pl',iy,im,client)
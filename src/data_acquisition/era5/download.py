@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import os
+import time
+# resumable downloads of CDS results: bytes go to <target>.part, a dropped connection
+# resumes with an HTTP Range request, and the file is renamed to target only after
+# its size (and md5 when CDS gives file:checksum) are verified
+CHUNK = 1 << 20 # block [bytes]
+TRY = 10 # attempts per file
+WAIT = 5 # seconds before the first retry, doubled each time
+
+def md5(fn):
+    h = hashlib.md5()
+    with open(fn, 'rb') as f:
+        for b in iter(lambda: f.read(CHUNK), b''): h.update(b)
+    return h.hexdigest()
+
+def digest(checksum): # md5 hex of a file:checksum, multihash (md5 code d5 01, length 10) or bare; None for other hashes
+    c = checksum.lower()
+    for pre in ('d50110', 'd510', ''):
+        if c.startswith(pre) and len(c) == len(pre) + 32: return c[len(pre):]
+    return None
+
+def verify(part,target,size=None,checksum=None): # check <target>.part and rename it
+    n = os.path.getsize(part)
+    why = ''
+    want = digest(checksum) if checksum else None
+    if checksum and want is None: print('no md5 check', os.path.basename(target), 'checksum', checksum[:6] + '...')
+    if size is not None and n != int(size): why = f'{n} bytes, expected {size}'
+    elif want and md5(part) != want: why = 'md5 mismatch'
+    if why:
+        os.remove(part)
+        raise IOError(f'{target}: {why}')
+    os.replace(part, target)
+    return target
+
+def offset(part,status): # bytes already on disk that the response continues
+    if status == 206 and os.path.exists(part): return os.path.getsize(part)
+    return 0
+
+def get(url,target,size=None,checksum=None,session=None,wait=None): # requests version
+    import requests
+    wait = WAIT if wait is None else wait
+    session = session or requests.Session()
+    part = target + '.part'
+    for i in range(TRY):
+        n = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and n == int(size): break
+        try:
+            with session.get(url, headers={'Range': f'bytes={n}-'} if n else {}, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                with open(part, 'ab' if offset(part, r.status_code) else 'wb') as f:
+                    for b in r.iter_content(CHUNK): f.write(b)
+            if size is None: break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            print('resume', os.path.basename(target), e.__class__.__name__)
+            time.sleep(wait * 2 ** i)
+    return verify(part,target,size,checksum)
+
+async def aget(session,url,target,size=None,checksum=None,wait=None): # aiohttp version
+    import aiohttp
+    wait = WAIT if wait is None else wait
+    part = target + '.part'
+    for i in range(TRY):
+        n = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and n == int(size): break
+        try:
+            async with session.get(url, headers={'Range': f'bytes={n}-'} if n else {}) as r:
+                r.raise_for_status()
+                with open(part, 'ab' if offset(part, r.status) else 'wb') as f:
+                    async for b in r.content.iter_chunked(CHUNK): f.write(b)
+            if size is None: break
+        except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            print('resume', os.path.basename(target), e.__class__.__name__)
+            await asyncio.sleep(wait * 2 ** i)
+    return verify(part,target,size,checksum)
@@ -0,0 +1,328 @@
+import collections
+import hashlib
+import os
+import netCDF4
+import numpy as np
+import pandas as pd
+# array kernels for the site extractors (met_share_*, pl_extract_*): each variable of
+# a file is read once as the site cell's whole time series and converted in numpy
+G = 9.80665 # gravity [m s^-2]
+LAP = -0.0065 # tentative temperature lapse rate [K m^-1]
+LAPS = (-0.0098, 0.02) # bounds of an hourly lapse rate from the levels [K m^-1]: dry adiabat, strong inversion
+SURFACE = ['u10','v10','t2m','d2m','sp','tp','ssrd','strd'] # single-level variables used
+ACCUM = ['tp','ssrd','strd'] # accumulated over the hour in hourly files, over a day in monthly means
+MET = ['at','pr','rh','ws','sp','srd','lrd','t2m'] # met output columns after year..doy
+TZ = 0 # day boundary [hours east of UTC], 9 for JST days as the JMA series
+STAT = {'pr': 'sum'} # daily statistic of a column, mean otherwise
+FMT = '%.6f' # fixed format of the float columns
+INDEX = 'grid_index' # cache of site cells per grid and of ERA5 elevations per geopotential file
+METHOD = 'nearest' # site value: the 'nearest' cell, or 'bilinear' / 'idw' over the surrounding cells
+POWER = 2 # inverse-distance power
+LAND = 0.5 # least land-sea mask of a cell a site may move to
+DZ = 300 # largest site - ERA5 elevation difference of that cell [m]
+K = 32 # nearest land cells tried per site
+_memo = {} # weights per grid and site list, for the life of a (worker) process
+BUDGET = 256 << 20 # bytes of values one process reads at a time, see hourly()
+COPY = 3 # float64 copies of a read alive at once: values, mask filled, picked sites
+NONE = np.iinfo(np.int64).min # epoch hour before any data
+DENSE = 0.5 # rows (columns) filling more than this of their range are read as one slice
+
+def axes(nc): # key of a grid: hash of its longitude/latitude axes
+    h = hashlib.sha1()
+    for k in ('longitude', 'latitude'): h.update(np.asarray(nc[k][:], dtype='f8').tobytes())
+    return h.hexdigest()[:16]
+
+def locate(nc,lon,lat): # nearest-cell arithmetic of the scripts for arrays of sites -> ix, iy, inside
+    dlon = np.asarray(nc['longitude'][:], dtype=float)
+    dlat = np.asarray(nc['latitude'][:], dtype=float)
+    nx, ny = len(dlon), len(dlat)
+    dgx = abs(dlon[0]-dlon[1]) # x interval
+    dgy = abs(dlat[0]-dlat[1]) # y interval
+    lx = dlon[0] - 0.5 * dgx # starting lon west -> east
+    uy = dlat[0] + 0.5 * dgy # starting lat north -> south
+    wrap = dlon.max() > 180 # global data lon:0->360, regional data lon:-180->180
+    if wrap: lon = np.where(lon < 0, lon + 360, lon) # replace west lon by east lon
+    ix = np.floor((lon - lx) / dgx).astype(int)
+    iy = np.floor((uy - lat) / dgy).astype(int)
+    if wrap: ix = np.where(ix >= nx, ix - nx, ix)
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    ix, iy = np.clip(ix, 0, nx - 1), np.clip(iy, 0, ny - 1)
+    return ix, iy, inside, dlon[ix], dlat[iy]
+
+def save(t,fn): # whole file or nothing, several workers may write the same table
+    os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+    tmp = f'{fn}.{os.getpid()}'
+    t.to_csv(tmp, index=False)
+    os.replace(tmp, fn)
+
+def same(t,df): # a cached table still describes the sites of df
+    return len(t) == len(df) and (t['site'].astype(str).values == df['site'].astype(str).values).all() \
+        and np.allclose(t['lon'], df['lon']) and np.allclose(t['lat'], df['lat'])
+
+def index(nc,df,path=INDEX): # cells of the sites of df on the grid of nc, cached per grid
+    fn = os.path.join(path, f'cell_{axes(nc)}.csv')
+    if os.path.exists(fn):
+        t = pd.read_csv(fn)
+        if same(t, df): return t
+    t = df[['site','lon','lat']].copy()
+    t['ix'], t['iy'], t['inside'], t['lon_era5'], t['lat_era5'] = locate(nc, df['lon'].values, df['lat'].values)
+    save(t, fn)
+    return t
+
+def elevation(fn,df,path=INDEX,method=METHOD): # ERA5 surface height at each site, the geopotential file is read once per version
+    st = os.stat(fn)
+    key = hashlib.sha1(f'{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}:{method}'.encode()).hexdigest()[:16]
+    out = os.path.join(path, f'elv_{key}.csv')
+    if os.path.exists(out):
+        t = pd.read_csv(out)
+        if same(t, df): return t
+    with netCDF4.Dataset(fn) as nc:
+        t = index(nc, df, path)
+        z = sample(nc, ['z'], df, np.arange(len(df)), method)['z'] # (site,) or (time, site)
+    t['elv_era5'] = z.reshape(-1, len(t))[0] / G # geopotential to height
+    save(t, out)
+    return t
+
+def xyz(lon,lat): # unit vectors, chord distance grows with great-circle distance
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def land(fn,df,path=INDEX,frac=LAND,dz=DZ,k=K): # nearest land cell of every site with |elv - ERA5 elevation| <= dz
+    # one tree over the land cells of the land-sea mask and geopotential in fn, one query for all sites
+    # -> df-like table (site, lon, lat of the chosen cell) for index/sample/elevation, cached like elevation
+    from scipy.spatial import cKDTree
+    st = os.stat(fn)
+    key = hashlib.sha1(f'{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}:{frac}:{dz}:{k}'.encode()).hexdigest()[:16]
+    out = os.path.join(path, f'land_{key}.csv')
+    if os.path.exists(out):
+        t = pd.read_csv(out)
+        if len(t) == len(df) and 'elv_site' in t and (t['site'].astype(str).values == df['site'].astype(str).values).all() \
+            and np.allclose(t['lon_site'], df['lon']) and np.allclose(t['lat_site'], df['lat']) and np.allclose(t['elv_site'], df['elv']):
+            return t # the chosen cell depends on elv as well
+    with netCDF4.Dataset(fn) as nc:
+        if 'lsm' not in nc.variables: raise KeyError(f'{fn} has no land_sea_mask (lsm), see get_srf5geopotential.py')
+        dlon = np.asarray(nc['longitude'][:], dtype=float)
+        dlat = np.asarray(nc['latitude'][:], dtype=float)
+        lsm = np.ma.filled(nc['lsm'][:].astype(float), 0).reshape(-1, len(dlat), len(dlon))[0]
+        z = np.ma.filled(nc['z'][:].astype(float), np.nan).reshape(-1, len(dlat), len(dlon))[0] / G
+    iy, ix = np.nonzero(lsm >= frac) # land cells
+    tree = cKDTree(xyz(dlon[ix], dlat[iy]))
+    elv = df['elv'].values.astype(float)
+    d, j = tree.query(xyz(df['lon'].values.astype(float), df['lat'].values.astype(float)), k=min(k, len(ix)))
+    d, j = d.reshape(len(df), -1), j.reshape(len(df), -1)
+    good = np.abs(z[iy[j], ix[j]] - elv[:,None]) <= dz # (site, candidate) in distance order
+    ok = good.any(axis=1)
+    r = np.arange(len(df))
+    pick = np.where(ok, good.argmax(axis=1), 0) # first good candidate, else the nearest land cell
+    c = j[r, pick]
+    t = pd.DataFrame({'site': df['site'], 'lon': (dlon[ix[c]] + 180) % 360 - 180, 'lat': dlat[iy[c]], # -180->180
+                      'lon_site': df['lon'], 'lat_site': df['lat'], 'elv_site': df['elv'], 'lsm': lsm[iy[c], ix[c]], 'elv_era5': z[iy[c], ix[c]],
+                      'km': 2 * np.arcsin(np.minimum(d[r, pick] / 2, 1)) * 6371.0, 'ok': ok}) # great-circle distance
+    save(t, out)
+    return t
+
+def weights(nc,df,method=METHOD,power=POWER): # sparse (site, cell) weights of the 2-4 grid points around each site
+    # cells are numbered over the block of rows uy x columns ux that covers all sites -> W, uy, ux
+    from scipy import sparse
+    key = (axes(nc), method, power, tuple(df['site'].astype(str)), tuple(df['lon']), tuple(df['lat']))
+    if key in _memo: return _memo[key]
+    dlon = np.asarray(nc['longitude'][:], dtype=float)
+    dlat = np.asarray(nc['latitude'][:], dtype=float)
+    nx, ny = len(dlon), len(dlat)
+    lon, lat = df['lon'].values.astype(float), df['lat'].values.astype(float)
+    wrap = dlon.max() > 180 # global data lon:0->360
+    if wrap: lon = np.where(lon < 0, lon + 360, lon)
+    fx = (lon - dlon[0]) / (dlon[1] - dlon[0]) # fractional grid position
+    fy = (lat - dlat[0]) / (dlat[1] - dlat[0])
+    x0, y0 = np.floor(fx).astype(int), np.floor(fy).astype(int)
+    px = np.stack([x0, x0+1, x0, x0+1]) # (corner, site), corner order (x0,y0) (x1,y0) (x0,y1) (x1,y1)
+    py = np.stack([y0, y0, y0+1, y0+1])
+    if method == 'bilinear':
+        wx, wy = fx - x0, fy - y0
+        w = np.stack([(1-wx)*(1-wy), wx*(1-wy), (1-wx)*wy, wx*wy])
+    elif method == 'idw':
+        dx = (fx - px) * abs(dlon[1] - dlon[0]) * np.cos(np.radians(lat)) # [deg of latitude]
+        dy = (fy - py) * abs(dlat[1] - dlat[0])
+        w = 1 / np.maximum(np.hypot(dx, dy), 1e-6) ** power
+    else:
+        raise ValueError(f'unknown interpolation {method}')
+    ix = px % nx if wrap else np.clip(px, 0, nx - 1) # edge sites fall back on the edge cells
+    iy = np.clip(py, 0, ny - 1)
+    w = w / w.sum(axis=0)
+    uy, jy = np.unique(iy, return_inverse=True)
+    ux, jx = np.unique(ix, return_inverse=True)
+    site = np.broadcast_to(np.arange(len(df)), w.shape)
+    col = jy.reshape(w.shape) * len(ux) + jx.reshape(w.shape)
+    W = sparse.csr_matrix((w.ravel(), (site.ravel(), col.ravel())), shape=(len(df), len(uy) * len(ux))) # duplicates add up
+    W.eliminate_zeros() # a zero weight must not pick up a missing value
+    _memo[key] = (W, uy, ux)
+    return _memo[key]
+
+def sample(nc,names,df,act,method=METHOD,it=None): # {name: (time, [level,] site)} for the sites act of df, it: time slice
+    if method == 'nearest':
+        g = index(nc, df)
+        return cells(nc, names, g['iy'].values[act], g['ix'].values[act], it)
+    W, uy, ux = weights(nc, df, method)
+    W = W[act]
+    out = {}
+    for k in names: # one orthogonal read of the block per variable, then one sparse product
+        x = block(nc,k,uy,ux,it)
+        lead = x.shape[:-2]
+        out[k] = (W @ x.reshape(-1, len(uy) * len(ux)).T).T.reshape(lead + (len(act),))
+    return out
+
+def axis(u): # netCDF index of the rows or columns u, positions of u in what it reads (None: as read)
+    if len(u) > 1 and len(u) >= DENSE * (u[-1] - u[0] + 1): return slice(u[0], u[-1] + 1), u - u[0]
+    return u, None # netCDF4 reads an index list element by element
+
+def block(nc,k,uy,ux,it=None): # k at rows uy x columns ux (over the time slice it) as float, nan where masked
+    ry, py = axis(uy)
+    rx, px = axis(ux)
+    x = np.ma.filled(nc[k][(Ellipsis, ry, rx) if it is None else (it, Ellipsis, ry, rx)].astype(float), np.nan)
+    if py is not None: x = x[..., py, :]
+    if px is not None: x = x[..., px]
+    return x
+
+def span(nc,df,act,method=METHOD): # rows uy and columns ux read for the sites act of df
+    if method == 'nearest':
+        g = index(nc, df)
+        return np.unique(g['iy'].values[act]), np.unique(g['ix'].values[act])
+    W, uy, ux = weights(nc, df, method)
+    return uy, ux
+
+def cost(nc,names,df,act,method=METHOD): # bytes held per hour while sample() reads names
+    n = [len(u) if axis(u)[1] is None else u[-1] - u[0] + 1 for u in span(nc, df, act, method)]
+    return sum(int(np.prod(nc[k].shape[1:-2])) for k in names) * int(n[0]) * int(n[1]) * 8 * COPY
+
+def hourly(n,cost,budget=BUDGET): # windows of at most budget/cost hours over n hours -> [slice]
+    w = max(1, int(min(budget / max(cost, 1), n))) # budget may be np.inf for one window
+    return [slice(i, min(i + w, n)) for i in range(0, n, w)]
+
+def inorder(pool,ahead,fn,*args): # pool.map with at most ahead calls submitted and not yet taken, results in order
+    run = collections.deque()
+    for a in zip(*args):
+        run.append(pool.submit(fn, *a))
+        if len(run) >= ahead: yield run.popleft().result()
+    while run: yield run.popleft().result()
+
+def gather(rows): # (site, epoch hours, hourly (time, var)) of windows -> one block per site, in first-seen order
+    out = {}
+    for ist, t, h in rows: out.setdefault(ist, []).append((t, h))
+    return [(ist, np.concatenate([t for t, h in b]), np.concatenate([h for t, h in b])) for ist, b in out.items()]
+
+def cells(nc,names,iy,ix,it=None): # {name: (time, [level,] site) float array}, one orthogonal read per variable
+    uy, jy = np.unique(iy, return_inverse=True) # rows and columns covering every site
+    ux, jx = np.unique(ix, return_inverse=True)
+    return {k: block(nc,k,uy,ux,it)[...,jy,jx] for k in names}
+
+def hours(nc,it=slice(None)): # valid_time (or the slice it of it) as integer hours since 1970-01-01 UTC
+    v = nc['valid_time']
+    d = netCDF4.num2date(v[it], v.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    return (np.array(d, dtype='datetime64[h]') - np.datetime64('1970-01-01T00','h')).astype(np.int64)
+
+def esat(t): # saturation vapour pressure [hPa], water above 0 degC and ice below
+    a = np.where(t >= 0, 7.5, 9.5)
+    b = np.where(t >= 0, 237.3, 265.5)
+    return 6.11 * 10**((a * t) / (b + t))
+
+def surface(v,dz,lap=LAP,sec=3600): # ERA5 single levels -> site met, dz: site minus ERA5 elevation [m]
+    t = v['t2m'] - 273.15 # from K to degC
+    d = v['d2m'] - 273.15 # from K to degC
+    return {'at': t + lap * dz, # calibrating elevation bias
+            'pr': v['tp'] * 1000, # from m to mm
+            'rh': esat(d) / esat(t) * 100,
+            'ws': np.hypot(v['u10'], v['v10']), # wind speed
+            'sp': v['sp'] / 100, # from Pa to hPa
+            'srd': v['ssrd'] / sec, # from J m^-2 to W m^-2
+            'lrd': v['strd'] / sec, # from J m^-2 to W m^-2
+            't2m': t}
+
+PL = ['pt','lap','tl','zl','pl','tu','zu','pu'] # pressure-level output columns after year..doy
+
+def bracket(z,t,plev,elv): # levels around the site for every hour at once
+    # z: geopotential [m2 s-2], t: temperature [K], both (time, level, site); elv: site elevation [m]
+    o = np.argsort(-np.asarray(plev, dtype=float)) # surface upwards, whatever order the file has
+    z, t, p = z[:,o] / G, t[:,o] - 273.15, np.asarray(plev, dtype=float)[o]
+    iu = np.clip((z <= elv).sum(axis=1), 1, len(p) - 1) # first level above the site, (time, site); end pairs extrapolate
+    il = iu - 1
+    at = lambda x, i: np.take_along_axis(x, i[:,None], axis=1)[:,0]
+    tu, zu, tl, zl = at(t,iu), at(z,iu), at(t,il), at(z,il)
+    lap = (tu - tl) / (zu - zl)
+    out = {'pt': lap * (elv - zl) + tl, 'lap': lap, 'tl': tl, 'zl': zl, 'pl': p[il], 'tu': tu, 'zu': zu, 'pu': p[iu]}
+    out['high'] = (z[:,-1] <= elv).sum(axis=0) # times above the highest level, per site
+    return out
+
+def lapse(top,ground,dz,lap=LAP,bounds=LAPS): # hourly rate between the profile temperatures at the site and at the ERA5 surface
+    # top, ground: bracket()['pt'] at the site and ERA5 elevations (time, site); dz: site minus ERA5 elevation [m]
+    with np.errstate(divide='ignore', invalid='ignore'): r = (top - ground) / dz
+    return np.clip(np.where(np.isfinite(r), r, lap), *bounds) # lap where the elevations are the same
+
+class Daily: # hourly blocks in, whole local days out; a day cut by the end of a block waits for the next one
+    def __init__(self, tz=TZ, nh=24):
+        self.tz, self.nh = tz, nh
+        self.t = self.x = None
+
+    def add(self, t, x): # t: epoch hours (time,), x: (time, ...) -> local day numbers (day,), hours of those days
+        if self.t is not None and len(self.t) and len(t) and t[0] == self.t[-1] + 1: # continues the last block
+            t, x = np.concatenate([self.t, t]), np.concatenate([self.x, x])
+        lead = -(t[0] + self.tz) % self.nh if len(t) else 0 # hours before the first local midnight
+        n = (len(t) - lead) // self.nh * self.nh
+        self.t, self.x = t[lead+n:], x[lead+n:]
+        return (t[lead:lead+n:self.nh] + self.tz) // self.nh, x[lead:lead+n]
+
+def daily(x,cols,extra=(),nh=24): # hours of whole days (day*nh, col) -> (day, col + extra)
+    # one pass per statistic over all columns; extra: [(col, 'max'|'min'|'sum'|'mean')]
+    d = x.reshape(-1, nh, x.shape[-1])
+    out = d.mean(axis=1)
+    s = [i for i, k in enumerate(cols) if STAT.get(k) == 'sum']
+    out[:,s] = d[:,:,s].sum(axis=1)
+    add = [getattr(d[:,:,cols.index(k)], how)(axis=1)[:,None] for k, how in extra]
+    return np.concatenate([out] + add, axis=1)
+
+def calendar(day): # local day numbers -> year, month, day, doy
+    d = np.datetime64('1970-01-01','D') + np.asarray(day).astype('timedelta64[D]')
+    y, m = d.astype('datetime64[Y]'), d.astype('datetime64[M]')
+    return y.astype(int) + 1970, (m - y).astype(int) + 1, (d - m).astype(int) + 1, (d - y).astype(int) + 1
+
+def days(y,mo): # days of months, leap years included
+    m = np.datetime64('1970-01','M') + ((np.asarray(y) - 1970) * 12 + np.asarray(mo) - 1).astype('timedelta64[M]')
+    return ((m + 1).astype('datetime64[D]') - m.astype('datetime64[D]')).astype(int)
+
+def months(nc): # year, month of each step of a monthly means file (date YYYYMMDD of the old CDS, or valid_time)
+    if 'valid_time' in nc.variables: return calendar(hours(nc) // 24)[:2]
+    d = np.asarray(nc['date'][:], dtype=np.int64)
+    return d // 10000, d // 100 % 100
+
+def last(w,tz=TZ,nh=24): # last epoch hour held by an hourly Writer, or by a daily one (hour 0, local days)
+    if w.last is None: return NONE
+    y, mo, d, hr = w.last[:4]
+    day = int((np.datetime64(f'{y:04d}-{mo:02d}-{d:02d}') - np.datetime64('1970-01-01')).astype(int))
+    return day * nh + hr - 1 if hr else (day + 1) * nh - tz - 1
+
+class Writer: # one CSV kept open for the whole run, a block of rows written in one call
+    def __init__(self, fn, header, nkey=5, fmt=FMT, resume=False): # the first nkey columns (year..doy) are integers
+        # resume: append to an existing fn, self.last is the key of its last row (None when empty)
+        self.nkey, self.fmt, self.last = nkey, fmt, None
+        if resume and os.path.exists(fn) and os.path.getsize(fn):
+            with open(fn, 'rb+') as f:
+                if f.readline().decode().rstrip('\r\n') != ','.join(header): raise ValueError(f'{fn}: other columns than {header}')
+                f.seek(0, 2)
+                n = f.tell()
+                f.seek(max(0, n - 65536))
+                tail = f.read()
+                cut = tail.rindex(b'\n') + 1
+                f.truncate(n - len(tail) + cut) # a row cut short by a crash is written again
+                last = tail[:cut].splitlines()[-1].decode().split(',')
+                if last[0] != header[0]: self.last = tuple(int(float(x)) for x in last[:nkey])
+            self.f = open(fn, 'a', newline='')
+        else:
+            self.f = open(fn, 'w', newline='')
+            self.f.write(','.join(header) + '\n')
+
+    def write(self, key, val): # key: nkey arrays or scalars, val: (row, col) floats
+        if len(val) == 0: return
+        key = [np.broadcast_to(k, len(val)) for k in key]
+        np.savetxt(self.f, np.column_stack(key + [val]), fmt=['%d'] * self.nkey + [self.fmt] * val.shape[1], delimiter=',')
+
+    def close(self):
+        self.f.close()
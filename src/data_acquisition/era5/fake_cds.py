@@ -0,0 +1,227 @@
+import calendar
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import cache
+import cds
+# local stand-in for the CDS client to run the scheduler offline
+# queue: seconds waiting in the CDS queue, work: seconds processing, cap: running jobs per user
+# jobs live in the Client object, so a restarted scheduler can reattach to them
+# downloads are synthetic ERA5-like NetCDF files shaped by the request; with
+# download_format zip, accumulated and instantaneous fields go to separate members as CDS does
+GRID = 0.25 # degree
+BASE = { # typical values of each variable (netcdf name)
+    'tp': 1e-4, 'ssrd': 4e5, 'strd': 1e6, 'u10': 2.0, 'v10': -1.0,
+    'd2m': 268.0, 't2m': 272.0, 'sp': 95000.0
+}
+ACCUM = ('tp', 'ssrd', 'strd') # stepType accum
+
+def listed(x): # request fields may be a single string or a list
+    return [x] if isinstance(x, str) else list(x)
+
+def hours(request): # epoch seconds of the real dates in the request
+    t = []
+    for yr in listed(request['year']):
+        for mn in listed(request['month']):
+            mdy = calendar.monthrange(int(yr),int(mn))[1]
+            for dy in listed(request.get('day', ['01'])):
+                if int(dy) > mdy: continue # CDS drops 29-31 in short months
+                for tm in listed(request['time']):
+                    t.append(calendar.timegm((int(yr),int(mn),int(dy),int(tm[:2]),0,0)))
+    return np.array(sorted(t), dtype='i8')
+
+def standard_height(p): # height [m] of pressure level [hPa] in the standard atmosphere
+    return 44330.8 * (1 - (p / 1013.25) ** 0.190263)
+
+def write(target, request):
+    import netCDF4
+    latn, lonw, lats, lone = request['area']
+    lat = np.arange(latn, lats - GRID / 2, -GRID)
+    lon = np.arange(lonw, lone + GRID / 2, GRID)
+    t = hours(request)
+    rnd = np.random.default_rng(int(t[0]) if len(t) else 0)
+    with cache.nclock, netCDF4.Dataset(target, 'w') as nc:
+        nc.createDimension('valid_time', len(t))
+        dims = ('valid_time',)
+        v = nc.createVariable('valid_time', 'i8', dims)
+        v.units = 'seconds since 1970-01-01'; v.calendar = 'proleptic_gregorian'; v[:] = t
+        if 'pressure_level' in request:
+            lev = np.array(sorted((float(p) for p in listed(request['pressure_level'])), reverse=True)) # surface first, as CDS writes them
+            nc.createDimension('pressure_level', len(lev))
+            nc.createVariable('pressure_level', 'f8', ('pressure_level',))[:] = lev
+            dims = dims + ('pressure_level',)
+        nc.createDimension('latitude', len(lat)); nc.createDimension('longitude', len(lon))
+        nc.createVariable('latitude', 'f8', ('latitude',))[:] = lat
+        nc.createVariable('longitude', 'f8', ('longitude',))[:] = lon
+        dims = dims + ('latitude', 'longitude')
+        shape = tuple(len(nc.dimensions[d]) for d in dims)
+        for name in listed(request['variable']):
+            short = cache.NAME[name]
+            if 'pressure_level' in request:
+                h = standard_height(lev)[None,:,None,None]
+                x = h * 9.80665 if short == 'z' else 288.15 - 0.0065 * h
+            else:
+                x = BASE[short]
+            x = x + abs(x) * 0.01 * rnd.standard_normal(shape) if short != 'z' else x + rnd.standard_normal(shape)
+            nc.createVariable(short, 'f4', dims, zlib=True)[:] = np.broadcast_to(x, shape)
+
+class Client:
+    def __init__(self, queue=1.0, work=0.2, cap=2, jitter=0.0, fail=0.0, key='fake', seed=None, poll=0.01):
+        self.queue, self.work, self.cap = queue, work, cap
+        self.jitter, self.fail, self.key, self.poll = jitter, fail, key, poll
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {} # jid -> job state
+        self.inflight = 0 # submitted, not yet finished
+        self.peak = 0 # max. inflight seen
+        self.calls = [] # (dataset, request) in submission order
+
+    def submit(self, dataset, request):
+        jid = str(uuid.uuid4())
+        with self.lock:
+            self.jobs[jid] = {
+                'dataset': dataset, 'request': request, 'state': 'accepted',
+                'queue': self.queue * (1 + self.jitter * self.rnd.random()),
+                'work': self.work * (1 + self.jitter * self.rnd.random()),
+                'fail': self.rnd.random() < self.fail,
+                'submitted': time.time(), 'started': None
+            }
+            self.calls.append((dataset, request))
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+        return jid
+
+    def status(self, jid):
+        now = time.time()
+        with self.lock:
+            job = self.jobs.get(jid)
+            if job is None: return 'dismissed'
+            running = sum(1 for j in self.jobs.values() if j['state'] == 'running')
+            if job['state'] == 'accepted' and now - job['submitted'] >= job['queue'] and running < self.cap:
+                job['state'], job['started'] = 'running', now
+            if job['state'] == 'running' and now - job['started'] >= job['work']:
+                job['state'] = 'failed' if job['fail'] else 'successful'
+                self.inflight -= 1
+            return job['state']
+
+    def download(self, jid, target):
+        request = self.jobs[jid]['request']
+        if request.get('download_format') != 'zip':
+            write(target, request)
+            return target
+        with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(target, 'w') as z:
+            for step in ('instant', 'accum'):
+                var = [v for v in request['variable'] if (cache.NAME[v] in ACCUM) == (step == 'accum')]
+                if not var: continue
+                fn = os.path.join(tmp, f'data_stream-oper_stepType-{step}.nc')
+                write(fn, dict(request, variable=var))
+                z.write(fn, os.path.basename(fn))
+        return target
+
+    def retrieve(self, dataset, request, target=None):
+        return cds.wait_download(self, self.submit(dataset, request), target, self.poll)
+
+class Handler(BaseHTTPRequestHandler): # CDS retrieve API (/api/retrieve/v1/...) over a fake Client
+    # enough of it for async_hour.Client and for ecmwf.datastores behind cds.Client
+    def log_message(self, *args): pass
+
+    def route(self): # path parts without the query string
+        return self.path.split('?')[0].strip('/').split('/')
+
+    def job(self, jid, state): # job document with the links ecmwf.datastores follows
+        url = f'{self.server.url}/retrieve/v1/jobs/{jid}'
+        job = self.server.fake.jobs.get(jid, {})
+        return {'jobID': jid, 'status': state, 'processID': job.get('dataset'),
+                'links': [{'rel': 'self', 'href': url}, {'rel': 'monitor', 'href': url}, {'rel': 'results', 'href': url + '/results'}]}
+
+    def reply(self, code, body):
+        b = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def allowed(self):
+        if self.headers.get('PRIVATE-TOKEN') == self.server.fake.key: return True
+        self.reply(401, {'title': 'invalid key'})
+        return False
+
+    def do_POST(self): # /api/retrieve/v1/processes/<dataset>/execution
+        part = self.route()
+        if not self.allowed(): return
+        if part[:4] != ['api','retrieve','v1','processes'] or part[5:] != ['execution']:
+            return self.reply(404, {'title': 'not found'})
+        inputs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['inputs']
+        jid = self.server.fake.submit(part[4], inputs)
+        self.reply(201, self.job(jid, 'accepted'))
+
+    def do_GET(self): # /api/retrieve/v1/jobs/<jid>[/results], /download/<jid>, messages and processes
+        part = self.route()
+        fake = self.server.fake
+        if part[:1] == ['download']: return self.send_file(part[1])
+        if part == ['api','catalogue','v1','messages']: return self.reply(200, {'messages': []})
+        if not self.allowed(): return
+        if part[:4] == ['api','retrieve','v1','processes'] and len(part) == 5: return self.reply(200, {'id': part[4]})
+        if part[:4] != ['api','retrieve','v1','jobs'] or len(part) not in (5, 6):
+            return self.reply(404, {'title': 'not found'})
+        state = fake.status(part[4])
+        if len(part) == 5: return self.reply(200, self.job(part[4], state))
+        if state != 'successful': return self.reply(404, {'title': f'job {state}'})
+        fn = self.server.result(part[4])
+        with open(fn, 'rb') as f: md5 = hashlib.md5(f.read()).hexdigest()
+        self.reply(200, {'asset': {'value': {'href': f'/download/{part[4]}',
+                                             'file:size': os.path.getsize(fn), 'file:checksum': 'd50110' + md5}}})
+
+    def send_file(self, jid): # honours Range, cuts the connection after server.drop bytes (server.drops times)
+        fn = self.server.result(jid)
+        with open(fn, 'rb') as f: b = f.read()
+        n = 0
+        rng = self.headers.get('Range', '')
+        if rng.startswith('bytes='): n = int(rng[6:].split('-')[0])
+        self.send_response(206 if n else 200)
+        if n: self.send_header('Content-Range', f'bytes {n}-{len(b)-1}/{len(b)}')
+        self.send_header('Content-Length', str(len(b) - n))
+        self.end_headers()
+        with self.server.lock:
+            cut = self.server.drop and self.server.cut.get(jid, 0) < self.server.drops
+            if cut: self.server.cut[jid] = self.server.cut.get(jid, 0) + 1
+        if cut:
+            self.wfile.write(b[n:n + self.server.drop])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2) # socket.SHUT_RDWR
+            return
+        self.wfile.write(b[n:])
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fake, port=0, drop=0, drops=0):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.fake = fake
+        self.drop, self.drops = drop, drops # disconnect after drop bytes, drops times per result
+        self.cut = {} # jid -> disconnects so far
+        self.tmp = tempfile.mkdtemp()
+        self.files = {} # jid -> result file
+        self.lock = threading.Lock()
+        self.url = f'http://127.0.0.1:{self.server_address[1]}/api'
+
+    def result(self, jid): # the result file of a job, written once
+        with self.lock:
+            if jid not in self.files:
+                self.files[jid] = self.fake.download(jid, os.path.join(self.tmp, jid))
+            return self.files[jid]
+
+def serve(fake, port=0, drop=0, drops=0): # start a fake CDS HTTP server in a thread, server.url is the API root
+    server = Server(fake, port, drop, drops)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,16 +1,39 @@
 import cdsapi
+import calendar
+import datetime
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+from pl_band import band
 
 odir = 'nc'
 site = 'pl'
 syr, eyr = 2010, 2020
 latn, lats, lonw, lone = 80, 70, -80, -60
+lag = 5 # days ERA5 lags real time
+last = datetime.date.today() - datetime.timedelta(days=lag) # last day published
+level = [
+    "300", "350", "400",
+    "450", "500", "550",
+    "600", "650", "700",
+    "750", "775", "800",
+    "825", "850", "875",
+    "900", "925", "950",
+    "975", "1000"
+]
+subset = True # only the levels bracketing the sites in site.ini (see pl_band.py)
+
+if subset: level = band('site.ini','surface_geopotential.nc',[latn,lonw,lats,lone],levels=level)
+print('levels:', level)
 
 os.makedirs(odir, exist_ok=True)
 for iy in range(syr,eyr+1,1):
     yr=str(iy)
     for im in range(1,13,1):
         mn = f'{im:02d}'
+        if (iy,im) > (last.year,last.month): break # not published yet
+        mdy = calendar.monthrange(iy,im)[1] # days of a month
+        if (iy,im) == (last.year,last.month): mdy = last.day
         print(yr,mn)
         dataset = "reanalysis-era5-pressure-levels"
         request = {
@@ -21,19 +44,7 @@ for iy in range(syr,eyr+1,1):
             ],
             "year": yr,
             "month": mn,
-            "day": [
-                "01", "02", "03",
-                "04", "05", "06",
-                "07", "08", "09",
-                "10", "11", "12",
-                "13", "14", "15",
-                "16", "17", "18",
-                "19", "20", "21",
-                "22", "23", "24",
-                "25", "26", "27",
-                "28", "29", "30",
-                "31"
-            ],
+            "day": [f'{d:02d}' for d in range(1,mdy+1,1)],
             "time": [
                 "00:00", "01:00", "02:00",
                 "03:00", "04:00", "05:00",
@@ -44,15 +55,7 @@ for iy in range(syr,eyr+1,1):
                 "18:00", "19:00", "20:00",
                 "21:00", "22:00", "23:00"
             ],
-            "pressure_level": [
-                "300", "350", "400",
-                "450", "500", "550",
-                "600", "650", "700",
-                "750", "775", "800",
-                "825", "850", "875",
-                "900", "925", "950",
-                "975", "1000"
-            ],
+            "pressure_level": level,
             "data_format": "netcdf",
             "download_format": "unarchived",
             "area": [latn, lonw, lats, lone]
@@ -1,5 +1,6 @@
 import cdsapi
 import os
+# not needed for months already held hourly: pl_extract_month.py derives them with derive = True
 
 odir = 'nc'
 site = 'pl'
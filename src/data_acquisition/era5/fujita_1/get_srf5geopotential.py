@@ -2,7 +2,7 @@ import cdsapi
 dataset = "reanalysis-era5-single-levels-monthly-means"
 request = {
     "product_type": ["monthly_averaged_reanalysis"],
-    "variable": ["geopotential"],
+    "variable": ["geopotential", "land_sea_mask"],
     "year": ["2020"],
     "month": ["01"],
     "time": ["00:00"],
@@ -1,16 +1,23 @@
 import cdsapi
+import calendar
+import datetime
 import os
 
 odir = 'nc'
 site = 'harutori_srf_'
 syr, eyr = 2010, 2020
 latn, lats, lonw, lone = 43, 42.75, 144, 144.5
+lag = 5 # days ERA5 lags real time
+last = datetime.date.today() - datetime.timedelta(days=lag) # last day published
 
 os.makedirs(odir, exist_ok=True)
 for iy in range(syr,eyr+1,1):
     yr=str(iy)
     for im in range(1,13,1):
         mn = f'{im:02d}'
+        if (iy,im) > (last.year,last.month): break # not published yet
+        mdy = calendar.monthrange(iy,im)[1] # days of a month
+        if (iy,im) == (last.year,last.month): mdy = last.day
         print(yr,mn)
         dataset = "reanalysis-era5-single-levels"
         request = {
@@ -27,19 +34,7 @@ for iy in range(syr,eyr+1,1):
             ],
             "year": yr,
             "month": mn,
-            "day": [
-                "01", "02", "03",
-                "04", "05", "06",
-                "07", "08", "09",
-                "10", "11", "12",
-                "13", "14", "15",
-                "16", "17", "18",
-                "19", "20", "21",
-                "22", "23", "24",
-                "25", "26", "27",
-                "28", "29", "30",
-                "31"
-            ],
+            "day": [f'{d:02d}' for d in range(1,mdy+1,1)],
             "time": [
                 "00:00", "01:00", "02:00",
                 "03:00", "04:00", "05:00",
@@ -1,5 +1,6 @@
 import cdsapi
 import os
+# not needed for months already held hourly: met_share_month.py derives them with derive = True
 
 odir = 'nc'
 site = 'srf'
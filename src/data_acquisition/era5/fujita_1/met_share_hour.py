@@ -1,114 +1,115 @@
 import pandas as pd
 import numpy as np
 import netCDF4
-import math
+import os
 import sys
-import csv
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+import archive
+import extract
 
-odir = 'nc'
-site = 'arctic'
+site = 'arctic' # data/nc/<site>/ of the sites not in a box of cluster.py (get_sites_hour.py)
+fuse = False # read the pressure levels with the surface files, correcting at by the hourly profile between the ERA5 surface and the site
+src = ['nc/' + site + '{ym}hour.nc'] + ['nc/pl{ym}hour.nc'] * fuse # monthly files here, or archive.layout('{site}', ['flx','sfc']) for def_hour.py
 nh = 24
-nd = 366
 nm = 12
+syr = 2011
+eyr = 2012
+lap = extract.LAP # tentative temperature lapse rate
+tz = extract.TZ # day boundary [hours east of UTC], 9 for JST days
+how = extract.METHOD # site value from the 'nearest' cell, or 'bilinear' / 'idw' over the surrounding cells
+match = False # take each site's values at its nearest land cell within extract.DZ of its elevation
+nw = os.cpu_count() # processes over the month files, 1 for a serial run; peak RSS about nw x (budget + 3 months of rows), see bench_stream.py
+budget = extract.BUDGET # bytes of ERA5 values each process reads at a time, a month is read in windows of hours
+resume = False # append to the outputs of an earlier run, reading only the months after what they hold
 
 df = pd.read_csv('site.ini') # site info. read
 ns = len(df['site']) # how many sites?
 slon = df['lon'] # site lon
 slat = df['lat'] # site lat
 selv = df['elv'] # site elv
+box = archive.boxes(df, site) # {box: sites} from data/nc/clusters.csv, or {site: all sites} without it
+arc = {b: archive.Archive([p.replace('{site}', b) for p in src]) for b in box} # months on disk, files opened only when read
+pos = extract.land('surface_geopotential.nc', df) if match else df # where the ERA5 values are taken
+if match: print('no land cell within', extract.DZ, 'm of the site elevation:', *pos['site'][~pos['ok']])
 fname = np.array([None] * ns, dtype=object) # set hourly output file
 dname = np.array([None] * ns, dtype=object) # set daily output file
-header = ['year','month','day','hour','doy','at','pr','rh','ws','sp','srd','lrd','t2m'] # set header for met output
+cols = extract.MET + extract.PL * fuse # columns after year..doy, with those of pl_extract_hour.py when fused
+ext = [('at','max'),('at','min')] + [('pt','max'),('pt','min')] * fuse # daily extremes, those of pl5daily when fused
+header = ['year','month','day','hour','doy'] + cols # set header for met output
 for ist in range(0,ns,1): # loop for site
-	fname[ist] = 'era5hour_' + str(df['site'][ist]) + '.csv' # set hourly output file & header
-	dname[ist] = 'era5daily_' + str(df['site'][ist]) + '.csv' # set daily output file & header
-	with open(fname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
-	with open(dname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
+	fname[ist] = 'era5hour_' + str(df['site'][ist]) + '.csv' # set hourly output file
+	dname[ist] = 'era5daily_' + str(df['site'][ist]) + '.csv' # set daily output file
+
+def windows(iyr,im,delv): # one month of the archive in windows of hours -> (site, epoch hours, hourly (time, var))
+	act = np.array([ist for ist in range(0,ns,1) if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]], dtype=int) # sites in period
+	for b in box: # the files of a box hold its own sites
+		yield from part(arc[b],act[np.isin(act, box[b])],iyr,im,delv)
+
+def part(arc,act,iyr,im,delv): # the sites act of one box
+	mn=format(im,'02')
+	ym = str(iyr) + mn
+	if len(act) == 0: return
+	if ym not in arc.months: print('no files for', ym, *arc.files(ym)); return
+	g = arc.index(pos, ym) # site cells on this grid, cached per grid
+
+	inside = g['inside'].values
+	if fuse: # pressure levels of the month, whose grid may differ
+		with netCDF4.Dataset(arc.files(ym)[-1]) as nc: plev, inside = nc['pressure_level'][:], inside & extract.index(nc, pos)['inside'].values
+	out = act[~inside[act]] # sites off this grid
+	if len(out): sys.exit('out of domain: ' + ' '.join(df['site'][out].astype(str)))
+	for j, ist in enumerate(act):
+		print(fname[ist],iyr,mn,slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist])
+	high = np.zeros(len(act), dtype=int) # hours above the top level
+	for t, v in arc.stream(ym, extract.SURFACE + ['z','t'] * fuse, pos, act, how, budget=budget): # all sites from one read per variable
+		if fuse: # surface and levels of the same hours
+			p = extract.bracket(v['z'],v['t'],plev,selv.values[act])
+			q = extract.bracket(v['z'],v['t'],plev,delv[act]) # the same profile at the ERA5 surface
+			high += p['high']
+			lp = extract.lapse(p['pt'], q['pt'], selv.values[act] - delv[act], lap) # hourly rate over the layers between the two
+		m = extract.surface(v, selv.values[act] - delv[act], lp if fuse else lap)
+		h = np.stack([m[k] for k in extract.MET] + [p[k] for k in extract.PL * fuse], axis=-1) # hourly (time, site, var)
+		for j, ist in enumerate(act): yield ist, t, h[:,j]
+	for j, ist in enumerate(act):
+		if high[j]: print(fname[ist], 'warning level not enough', high[j], 'hours')
 
-nc = netCDF4.Dataset('surface_geopotential.nc') # geopotential data
-# global data lon:0->360
-dlon = nc['longitude'] # era5 lot
-dlat = nc['latitude'] # era5 lat
-delv = np.zeros((ns)) # era5 elv array
-nx = len(dlon) # x length
-ny = len(dlat) # y length
-dgx = abs(dlon[0]-dlon[1]) # x interval
-dgy = abs(dlat[0]-dlat[1]) # y interval
-lx = float(dlon[0]) - 0.5 * dgx # starting lon west -> east
-uy = float(dlat[0]) + 0.5 * dgy # starting lat north -> south
-header = ['site_name','lon_site','lon_era5','lat_site','lat_era5','z_site','z_era5']
-with open('era5site_summary.csv', 'w', newline='') as f:
-	writer = csv.writer(f); writer.writerow(header)
+def month(iyr,im,delv): # run in a worker -> [(site, epoch hours, hourly (time, var))], a block per site to pickle
+	return extract.gather(windows(iyr,im,delv))
+
+if __name__ == '__main__':
+	fout = np.array([None] * ns, dtype=object) # hourly writers, open for the whole run
+	dout = np.array([None] * ns, dtype=object) # daily writers, open for the whole run
 	for ist in range(0,ns,1):
-		xx = slon[ist]
-		if slon[ist] < 0: xx = slon[ist] + 360 # replace west lon by east lon
-		ix = int((xx - lx) / dgx)
-		if ix >= nx: ix = ix - nx
-		iy = int((uy - slat[ist]) / dgy) # north -> southh
-		delv[ist] = nc['z'][iy,ix] / 9.80665 # geopotential to height
-		print(df['site'][ist],slon[ist],dlon[ix],slat[ist],dlat[iy],selv[ist],delv[ist])
-		var = np.array((df['site'][ist],slon[ist],dlon[ix],slat[ist],dlat[iy],selv[ist],delv[ist]))
-		writer.writerow(var)
+		fout[ist] = extract.Writer(fname[ist], header, resume=resume)
+		dout[ist] = extract.Writer(dname[ist], header + [k + how for k, how in ext], resume=resume) # daily extremes
+	hl = np.array([extract.last(w) for w in fout]) # last hour written per site
+	dl = np.array([extract.last(w, tz) for w in dout]) # last hour of the whole days written per site
 
-syr = 2011
-eyr = 2012
-lap = -0.0065 # tentative temperature lapse rate
-for iyr in range(syr,eyr+1,1):
-	dye = 0
-	for im in range(1,nm+1,1):
-		mn=format(im,'02')
-		nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + str(mn) + 'hour.nc')
-		# regional data lon:-180->180
-		nt = len(nc['valid_time']) # t length month-day x hour
-		mdy = int(nt / nh) # days of a month
-		nx = len(nc['longitude']) # x length
-		ny = len(nc['latitude']) # y length
-		dlon = nc['longitude'] # set lon array
-		dlat = nc['latitude'] # set lon array
-		dgx = abs(dlon[0]-dlon[1])
-		dgy = abs(dlat[0]-dlat[1])
-		lx = float(dlon[0]) - 0.5 * dgx # starting lon
-		uy = float(dlat[0]) + 0.5 * dgy # starting lat
+	g = extract.elevation('surface_geopotential.nc', pos, method=how) # site cells and ERA5 elevations, cached in grid_index/
+	delv = g['elv_era5'].values # era5 elv array
+	for ist in range(0,ns,1):
+		print(df['site'][ist],slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist],selv[ist],delv[ist])
+	pd.DataFrame({'site_name': df['site'], 'lon_site': slon, 'lon_era5': g['lon_era5'], 'lat_site': slat,
+		'lat_era5': g['lat_era5'], 'z_site': selv, 'z_era5': delv}).to_csv('era5site_summary.csv', index=False)
 
-		for ist in range(0,ns,1):
-			if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]:
-				ix = int((slon[ist] - lx) / dgx)
-				iy = int((uy - slat[ist]) / dgy)
-				if ix < 0 or ix >= nx: sys.exit('out of domain for longitude')
-				if iy < 0 or iy >= ny: sys.exit('out of domain for latitude')
-				print(fname[ist],iyr,mn,slon[ist],dlon[ix],slat[ist],dlat[iy])
-				dws = np.zeros((mdy)); dat = np.zeros((mdy)); dt = np.zeros((mdy)) # prepare daily arrays
-				drh = np.zeros((mdy)); dsp = np.zeros((mdy)); dpr = np.zeros((mdy)) # prepare daily arrays
-				dsr = np.zeros((mdy)); dlr = np.zeros((mdy)) # prepare daily arrays
-				with open(fname[ist], 'a', newline='') as f: # hourly data
-					it = -1
-					for md in range(0,mdy,1):
-						for ih in range(0,nh,1):
-							it = it + 1
-							u = nc['u10'][it,iy,ix]
-							v = nc['v10'][it,iy,ix]
-							ws = math.sqrt(u**2 + v**2); dws[md] = dws[md] + ws / nh # wind speed
-							t = nc['t2m'][it,iy,ix] - 273.15; dt[md] = dt[md] + t / nh # from K to degC
-							d = nc['d2m'][it,iy,ix] - 273.15 # from K to degC
-							at = t + lap * (selv[ist] - delv[ist]); dat[md] = dat[md] + at / nh # calibrating elevation bias
-							# calculate rh #
-							if t >= 0: a = 7.5;b = 237.3
-							else: a = 9.5;b = 265.5
-							eat = 6.11 * 10**((a * t) / (b + t))
-							if d >= 0: a = 7.5;b = 237.3
-							else: a = 9.5;b = 265.5
-							edt = 6.11 * 10**((a * d) / (b + d))
-							rh = edt / eat * 100; drh[md] = drh[md] + rh / nh
-							sp = nc['sp'][it,iy,ix] / 100; dsp[md] = dsp[md] + sp / nh # from Pa to hPa
-							pr = nc['tp'][it,iy,ix] * 1000; dpr[md] = dpr[md] + pr # from m to mm, and monthly sum
-							srd = nc['ssrd'][it,iy,ix] / 3600; dsr[md] = dsr[md] + srd / nh # from J m^-2 to W m^-2
-							lrd = nc['strd'][it,iy,ix] / 3600; dlr[md] = dlr[md] + lrd / nh # from J m^-2 to W m^-2
-							var = np.array((iyr,im,md+1,ih+1,dye+md+1,at,pr,rh,ws,sp,srd,lrd,t))
-							writer = csv.writer(f); writer.writerow(var)
-				with open(dname[ist], 'a', newline='') as f: # daily means
-					for md in range(0,mdy,1):
-						var = np.array((iyr,im,md+1,0,dye+md+1,dat[md],dpr[md],drh[md],dws[md],dsp[md],dsr[md],dlr[md],dt[md]))
-						writer = csv.writer(f); writer.writerow(var)
-		dye = dye + mdy # doy at end of a month
+	day = [extract.Daily(tz) for ist in range(0,ns,1)] # hours waiting for the rest of their day
+	first = min(hl.min(), dl.min()) + 1 # first hour still to write
+	ym = [(iyr,im) for iyr in range(syr,eyr+1,1) for im in range(1,nm+1,1) if archive.bounds(f'{iyr}{im:02d}')[1] > first]
+	with ProcessPoolExecutor(nw) as pool:
+		if nw > 1: res = (r for rs in extract.inorder(pool, nw + 1, month, [y for y, m in ym], [m for y, m in ym], [delv] * len(ym)) for r in rs) # in calendar order, at most nw + 1 months held
+		else: res = (r for y, m in ym for r in windows(y, m, delv)) # serial: rows written as each window is read
+		for ist, t, h in res: # rows keyed by valid_time, hours already written are skipped
+			k = t > hl[ist]
+			if k.any():
+				y, mo, d, doy = extract.calendar(t[k] // nh) # date of each hour from valid_time
+				fout[ist].write((y,mo,d,t[k] % nh + 1,doy), h[k]) # hourly data
+				hl[ist] = t[k][-1]
+			k = t > dl[ist]
+			if k.any():
+				dn, x = day[ist].add(t[k], h[k]) # whole local days so far
+				dl[ist] = t[k][-1]
+				dm = extract.daily(x, cols, ext) # daily means, precipitation sum and extremes
+				dy, dmn, dd, doy = extract.calendar(dn)
+				dout[ist].write((dy,dmn,dd,0,doy), dm) # daily data
+	for ist in range(0,ns,1):
+		fout[ist].close(); dout[ist].close()
@@ -1,97 +1,75 @@
 import pandas as pd
 import numpy as np
 import netCDF4
-import math
+import os
 import sys
-import csv
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+import archive
+import extract
 
 odir = 'nc'
 site = 'arctic'
+derive = False # monthly means from the hourly files of src instead of the monthly downloads (get_srf5mon.py)
+src = odir + '/' + site + '{ym}hour.nc' # hourly files, or archive.layout(site, ['flx','sfc']) for def_hour.py
+how = extract.METHOD # site value from the 'nearest' cell, or 'bilinear' / 'idw' over the surrounding cells
+match = False # take each site's values at its nearest land cell within extract.DZ of its elevation
 
 df = pd.read_csv('site.ini') # site info. read
 ns = len(df['site']) # how many sites?
 slon = df['lon'] # site lon
 slat = df['lat'] # site lat
 selv = df['elv'] # site elv
+pos = extract.land('surface_geopotential.nc', df) if match else df # where the ERA5 values are taken
+if match: print('no land cell within', extract.DZ, 'm of the site elevation:', *pos['site'][~pos['ok']])
 fname = np.array([None] * ns, dtype=object) # set monthly trd array
+fout = np.array([None] * ns, dtype=object) # writers, open for the whole run
 header = ['year','month','at','pr','rh','ws','sp','srd','lrd','t2m','d2m','u','v'] # set header for met output
 for ist in range(0,ns,1): # loop for site
 	fname[ist] = 'era5mon_' + str(df['site'][ist]) + '.csv' # set output file & header
-	with open(fname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
+	fout[ist] = extract.Writer(fname[ist], header, 2)
 
-nc = netCDF4.Dataset('surface_geopotential.nc') # geopotential data
-# global data lon:0->360
-dlon = nc['longitude'] # era5 lot
-dlat = nc['latitude'] # era5 lat
-delv = np.zeros((ns)) # era5 elv array
-nx = len(dlon) # x length
-ny = len(dlat) # y length
-dgx = abs(dlon[0]-dlon[1]) # x interval
-dgy = abs(dlat[0]-dlat[1]) # y interval
-lx = float(dlon[0]) - 0.5 * dgx # starting lon west -> east
-uy = float(dlat[0]) + 0.5 * dgy # starting lat north -> south
-header = ['site_name','lon_site','lon_era5','lat_site','lat_era5','z_site','z_era5'] # header for the site file
-with open('era5site_summary.csv', 'w', newline='') as f:
-	writer = csv.writer(f); writer.writerow(header)
-	for ist in range(0,ns,1):
-		xx = slon[ist]
-		if slon[ist] < 0: xx = slon[ist] + 360 # replace west lon by east lon
-		ix = int((xx - lx) / dgx)
-		if ix >= nx: ix = ix - nx
-		iy = int((uy - slat[ist]) / dgy) # north -> southh
-		delv[ist] = nc['z'][iy,ix] / 9.80665 # geopotential to height
-		print(df['site'][ist],slon[ist],dlon[ix],slat[ist],dlat[iy],selv[ist],delv[ist])
-		var = np.array((df['site'][ist],slon[ist],dlon[ix],slat[ist],dlat[iy],selv[ist],delv[ist]))
-		writer.writerow(var)
+g = extract.elevation('surface_geopotential.nc', pos, method=how) # site cells and ERA5 elevations, cached in grid_index/
+delv = g['elv_era5'].values # era5 elv array
+for ist in range(0,ns,1):
+	print(df['site'][ist],slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist],selv[ist],delv[ist])
+pd.DataFrame({'site_name': df['site'], 'lon_site': slon, 'lon_era5': g['lon_era5'], 'lat_site': slat,
+	'lat_era5': g['lat_era5'], 'z_site': selv, 'z_era5': delv}).to_csv('era5site_summary.csv', index=False)
 
 syr = 2010 # starting year for existing data
 eyr = 2020 # end year for existing data
-lap = -0.0065 # tentative temperature lapse rate
+lap = extract.LAP # tentative temperature lapse rate
+arc = archive.Archive(src) if derive else None
 for iyr in range(syr,eyr+1,1):
-	nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + 'mon.nc')
-	# regional data lon:-180->180
-	nt = len(nc['date']) # t length
-	nx = len(nc['longitude']) # x length
-	ny = len(nc['latitude']) # y length
-	#date = nc['date'] # set lon array
-	dlon = nc['longitude'] # set lon array
-	dlat = nc['latitude'] # set lon array
-	dgx = abs(dlon[0]-dlon[1]) # x interval
-	dgy = abs(dlat[0]-dlat[1]) # y interval
-	lx = float(dlon[0]) - 0.5 * dgx # starting lon
-	uy = float(dlat[0]) + 0.5 * dgy # starting lat
+	if derive:
+		yms = [ym for ym in arc.months if ym[:4] == str(iyr)]
+		if len(yms) == 0: continue
+		g = arc.index(pos, yms[0]) # site cells on this grid, cached per grid
+	else:
+		nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + 'mon.nc')
+		# regional data lon:-180->180
+		g = extract.index(nc, pos) # site cells on this grid, cached per grid
 
-	for ist in range(0,ns,1):
-		if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]: # calculate if iyr within the duration in the site file
-			ix = int((slon[ist] - lx) / dgx)
-			iy = int((uy - slat[ist]) / dgy)
-			if ix < 0 or ix >= nx: sys.exit('out of domain for longitude') # stop if the target point does not exist in the era5 file
-			if iy < 0 or iy >= ny: sys.exit('out of domain for latitude') # stop if the target point does not exist in the era5 file
-			print(fname[ist],slon[ist],dlon[ix],slat[ist],dlat[iy])
-			with open(fname[ist], 'a', newline='') as f:
-				for it in range(0,nt,1):
-					u = nc['u10'][it,iy,ix]
-					v = nc['v10'][it,iy,ix]
-					ws = math.sqrt(u**2 + v**2) # wind speed
-					d = nc['d2m'][it,iy,ix] - 273.15 # from K to degC
-					t = nc['t2m'][it,iy,ix] - 273.15 # from K to degC
-					at = t + lap * (selv[ist] - delv[ist]) # calibrating elevation bias
-					# calculate rh #
-					if t >= 0: a = 7.5;b = 237.3
-					else: a = 9.5;b = 265.5
-					eat = 6.11 * 10**((a * t) / (b + t))
-					if d >= 0: a = 7.5;b = 237.3
-					else: a = 9.5;b = 265.5
-					edt = 6.11 * 10**((a * d) / (b + d))
-					rh = edt / eat * 100
-					sp = nc['sp'][it,iy,ix] / 100 # from Pa to hPa
-					im = it + 1 # month
-					mdy = 31 # days of month
-					if im == 4 or im == 6 or im == 9 or im ==11: mdy = 30 # Apr, Jun, Sep, Nov
-					if im == 2: mdy = 28 # Feb (no Olympic year consideration)
-					pr = nc['tp'][it,iy,ix] * 1000 * mdy # from m to mm, and monthly sum
-					srd = nc['ssrd'][it,iy,ix] / 86400 # from J m^-2 to W m^-2
-					lrd = nc['strd'][it,iy,ix] / 86400 # from J m^-2 to W m^-2
-					var = np.array((iyr,im,at,pr,rh,ws,sp,srd,lrd,t,d,u,v))
-					writer = csv.writer(f); writer.writerow(var)
+	act = np.array([ist for ist in range(0,ns,1) if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]]) # sites in period
+	if len(act) == 0: continue
+	out = act[~g['inside'].values[act]] # sites off this grid
+	if len(out): sys.exit('out of domain: ' + ' '.join(df['site'][out].astype(str)))
+	if derive: # means of the whole months of hourly data, accumulations per day as in the monthly means
+		mo, v = [], {k: [] for k in extract.SURFACE}
+		for ym in yms:
+			n, x = arc.mean(ym, extract.SURFACE, pos, act, how)
+			if n != extract.days(iyr, int(ym[4:])) * 24: print('incomplete month', ym, n, 'hours'); continue
+			mo.append(int(ym[4:]))
+			for k in extract.SURFACE: v[k].append(x[k] * (24 if k in extract.ACCUM else 1))
+		if len(mo) == 0: continue
+		mo, v = np.array(mo), {k: np.array(v[k]) for k in v}
+	else:
+		mo = extract.months(nc)[1] # months in the file
+		v = extract.sample(nc,extract.SURFACE,pos,act,how) # all sites from one read per variable, (month, site)
+	m = extract.surface(v, selv.values[act] - delv[act], lap, 86400) # daily mean flux, from J m^-2 to W m^-2
+	mdy = extract.days(iyr, mo)[:,None] # days of month, leap years included
+	pr = m['pr'] * mdy # from mm/day to monthly sum
+	h = np.stack([m['at'],pr,m['rh'],m['ws'],m['sp'],m['srd'],m['lrd'],m['t2m'],v['d2m']-273.15,v['u10'],v['v10']], axis=-1) # (month, site, var)
+	for j, ist in enumerate(act):
+		print(fname[ist],slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist])
+		fout[ist].write((iyr,mo), h[:,j])
+for ist in range(0,ns,1): fout[ist].close()
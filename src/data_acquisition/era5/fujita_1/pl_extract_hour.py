@@ -1,95 +1,93 @@
 import pandas as pd
 import numpy as np
 import netCDF4
-import math
+import os
 import sys
-import csv
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+import archive
+import extract
 
-odir = 'nc'
 site = 'pl'
+src = 'nc/' + site + '{ym}hour.nc' # monthly files here, or archive.layout(site, ['pl']) for def_hour.py
 nh = 24
 nm = 12
+syr = 2010
+eyr = 2012
+tz = extract.TZ # day boundary [hours east of UTC], 9 for JST days
+how = extract.METHOD # site value from the 'nearest' cell, or 'bilinear' / 'idw' over the surrounding cells
+match = False # take each site's values at its nearest land cell within extract.DZ of its elevation
+nw = os.cpu_count() # processes over the month files, 1 for a serial run; peak RSS about nw x (budget + 3 months of rows), see bench_stream.py
+budget = extract.BUDGET # bytes of ERA5 values each process reads at a time, a month is read in windows of hours
+resume = False # append to the outputs of an earlier run, reading only the months after what they hold
 
 df = pd.read_csv('site.ini') # site info. read
 ns = len(df['site']) # how many sites?
 slon = df['lon'] # site lon
 slat = df['lat'] # site lat
 selv = df['elv'] # site elv
+arc = archive.Archive(src) # months on disk, files opened only when read
+pos = extract.land('surface_geopotential.nc', df) if match else df # where the ERA5 values are taken
+if match: print('no land cell within', extract.DZ, 'm of the site elevation:', *pos['site'][~pos['ok']])
 fname = np.array([None] * ns, dtype=object) # set hourly output file
 dname = np.array([None] * ns, dtype=object) # set daily output file
 # set header for met output
 header = ['year','month','day','hour','doy','pt','lap','tl','zl','pl','tu','zu','pu']
 for ist in range(0,ns,1): # loop for site
-	fname[ist] = 'pl5hour_' + str(df['site'][ist]) + '.csv' # set output file & header
-	dname[ist] = 'pl5daily_' + str(df['site'][ist]) + '.csv' # set output file & header
-	with open(fname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
-	with open(dname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
+	fname[ist] = 'pl5hour_' + str(df['site'][ist]) + '.csv' # set output file
+	dname[ist] = 'pl5daily_' + str(df['site'][ist]) + '.csv' # set output file
 
-syr = 2010
-eyr = 2012
-for iyr in range(syr,eyr+1,1):
-	dye = 0
-	for im in range(1,nm+1,1):
-		mn=format(im,'02')
-		nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + str(mn) + 'hour.nc')
-		# regional data lon:-180->180
-		nt = len(nc['valid_time']) # t length month-day x hour
-		mdy = int(nt / nh) # days of a month
-		nx = len(nc['longitude']) # x length
-		ny = len(nc['latitude']) # y length
-		nz = len(nc['pressure_level']) # z length
-		dlon = nc['longitude'] # set lon array
-		dlat = nc['latitude'] # set lon array
-		dgx = abs(dlon[0]-dlon[1])
-		dgy = abs(dlat[0]-dlat[1])
-		lx = float(dlon[0]) - 0.5 * dgx # starting lon
-		uy = float(dlat[0]) + 0.5 * dgy # starting lat
+def windows(iyr,im): # one month of the archive in windows of hours -> (site, epoch hours, hourly (time, var))
+	mn=format(im,'02')
+	ym = str(iyr) + mn
+	if ym not in arc.months: print('no files for', ym, *arc.files(ym)); return
+	g = arc.index(pos, ym) # site cells on this grid, cached per grid
+	with netCDF4.Dataset(arc.files(ym)[0]) as nc: plev = nc['pressure_level'][:]
+
+	act = np.array([ist for ist in range(0,ns,1) if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]]) # sites in period
+	if len(act) == 0: return
+	out = act[~g['inside'].values[act]] # sites off this grid
+	if len(out): sys.exit('out of domain: ' + ' '.join(df['site'][out].astype(str)))
+	high = np.zeros(len(act), dtype=int) # hours above the top level
+	for t, v in arc.stream(ym, ['z','t'], pos, act, how, budget=budget): # (time, level, site) profiles of all sites
+		m = extract.bracket(v['z'],v['t'],plev,selv.values[act])
+		h = np.stack([m[k] for k in extract.PL], axis=-1) # hourly (time, site, var)
+		high += m['high']
+		for j, ist in enumerate(act): yield ist, t, h[:,j]
+	for j, ist in enumerate(act):
+		print(fname[ist],iyr,mn,slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist])
+		if high[j]: print('warning level not enough', high[j], 'hours')
+
+def month(iyr,im): # run in a worker -> [(site, epoch hours, hourly (time, var))], a block per site to pickle
+	return extract.gather(windows(iyr,im))
+
+if __name__ == '__main__':
+	fout = np.array([None] * ns, dtype=object) # hourly writers, open for the whole run
+	dout = np.array([None] * ns, dtype=object) # daily writers, open for the whole run
+	for ist in range(0,ns,1):
+		fout[ist] = extract.Writer(fname[ist], header, resume=resume)
+		dout[ist] = extract.Writer(dname[ist], header + ['ptmax','ptmin'], resume=resume) # daily extremes of pt
+	hl = np.array([extract.last(w) for w in fout]) # last hour written per site
+	dl = np.array([extract.last(w, tz) for w in dout]) # last hour of the whole days written per site
 
-		for ist in range(0,ns,1):
-			if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]:
-				ix = int((slon[ist] - lx) / dgx)
-				iy = int((uy - slat[ist]) / dgy)
-				if ix < 0 or ix >= nx: sys.exit('out of domain for longitude')
-				if iy < 0 or iy >= ny: sys.exit('out of domain for latitude')
-				print(fname[ist],iyr,mn,slon[ist],dlon[ix],slat[ist],dlat[iy])
-				dpt = np.zeros((mdy)); dlap = np.zeros((mdy))
-				dtl = np.zeros((mdy)); dzl = np.zeros((mdy)); dpl = np.zeros((mdy))
-				dtu = np.zeros((mdy)); dzu = np.zeros((mdy)); dpu = np.zeros((mdy))
-				with open(fname[ist], 'a', newline='') as f: # hourly data
-					iz = 1
-					it = -1
-					for md in range(0,mdy,1):
-						for ih in range(0,nh,1):
-							it = it + 1
-							izl = nz
-							while izl == nz:
-								if selv[ist] < nc['z'][it,iz,iy,ix] / 9.80665:
-									izu = iz
-									izl = izu - 1
-									if izl > 0 and selv[ist] < nc['z'][it,izl,iy,ix] / 9.80665:
-										print('level setting not enough low')
-									iz = iz - 2
-									if iz < 1: iz = 1
-								else: iz = iz + 1
-								if iz > nz and selv[ist] > nc['z'][it,iz,iy,ix] / 9.80665:
-									print('warning level not enough')
-									izu = nz
-									izl = izu - 1
-									iz = 1
-							tu = nc['t'][it,izu,iy,ix] - 273.15; dtu[md] = dtu[md] + tu / nh
-							zu = nc['z'][it,izu,iy,ix] / 9.80665; dzu[md] = dzu[md] + zu / nh
-							pu = nc['pressure_level'][izu]; dpu[md] = dpu[md] + pu / nh
-							tl = nc['t'][it,izl,iy,ix] - 273.15; dtl[md] = dtl[md] + tl / nh
-							zl = nc['z'][it,izl,iy,ix] / 9.80665; dzl[md] = dzl[md] + zl / nh
-							pl = nc['pressure_level'][izl]; dpl[md] = dpl[md] + pl / nh
-							lap = (tu - tl) / (zu - zl); dlap[md] = dlap[md] + lap / nh
-							pt = lap * (selv[ist] - zl) + tl; dpt[md] = dpt[md] + pt / nh
-							var = np.array((iyr,im,md+1,ih+1,dye+md+1,pt,lap,tl,zl,pl,tu,zu,pu))
-							writer = csv.writer(f); writer.writerow(var)
-				with open(dname[ist], 'a', newline='') as f: # daily means
-					for md in range(0,mdy,1):
-						var = np.array((iyr,im,md+1,0,dye+md+1,dpt[md],dlap[md],dtl[md],dzl[md],dpl[md],dtu[md],dzu[md],dpu[md]))
-						writer = csv.writer(f); writer.writerow(var)
-		dye = dye + mdy # doy at end of a month
+	day = [extract.Daily(tz) for ist in range(0,ns,1)] # hours waiting for the rest of their day
+	first = min(hl.min(), dl.min()) + 1 # first hour still to write
+	ym = [(iyr,im) for iyr in range(syr,eyr+1,1) for im in range(1,nm+1,1) if archive.bounds(f'{iyr}{im:02d}')[1] > first]
+	with ProcessPoolExecutor(nw) as pool:
+		if nw > 1: res = (r for rs in extract.inorder(pool, nw + 1, month, [y for y, m in ym], [m for y, m in ym]) for r in rs) # in calendar order, at most nw + 1 months held
+		else: res = (r for y, m in ym for r in windows(y, m)) # serial: rows written as each window is read
+		for ist, t, h in res: # rows keyed by valid_time, hours already written are skipped
+			k = t > hl[ist]
+			if k.any():
+				y, mo, d, doy = extract.calendar(t[k] // nh) # date of each hour from valid_time
+				fout[ist].write((y,mo,d,t[k] % nh + 1,doy), h[k]) # hourly data
+				hl[ist] = t[k][-1]
+			k = t > dl[ist]
+			if k.any():
+				dn, x = day[ist].add(t[k], h[k]) # whole local days so far
+				dl[ist] = t[k][-1]
+				dm = extract.daily(x, extract.PL, [('pt','max'),('pt','min')]) # daily means and extremes
+				dy, dmn, dd, doy = extract.calendar(dn)
+				dout[ist].write((dy,dmn,dd,0,doy), dm) # daily data
+	for ist in range(0,ns,1):
+		fout[ist].close(); dout[ist].close()
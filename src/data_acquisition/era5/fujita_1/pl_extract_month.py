@@ -1,75 +1,67 @@
 import pandas as pd
 import numpy as np
 import netCDF4
-import math
+import os
 import sys
-import csv
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+import archive
+import extract
 
 odir = 'nc'
 site = 'pl'
+derive = False # monthly means from the hourly files of src instead of the monthly downloads (get_pl5mon.py)
+src = odir + '/' + site + '{ym}hour.nc' # hourly files, or archive.layout(site, ['pl']) for def_hour.py
+how = extract.METHOD # site value from the 'nearest' cell, or 'bilinear' / 'idw' over the surrounding cells
+match = False # take each site's values at its nearest land cell within extract.DZ of its elevation
 
 df = pd.read_csv('site.ini') # site info. read
 ns = len(df['site']) # how many sites?
 slon = df['lon'] # site lon
 slat = df['lat'] # site lat
 selv = df['elv'] # site elv
+pos = extract.land('surface_geopotential.nc', df) if match else df # where the ERA5 values are taken
+if match: print('no land cell within', extract.DZ, 'm of the site elevation:', *pos['site'][~pos['ok']])
 fname = np.array([None] * ns, dtype=object) # set monthly trd array
+fout = np.array([None] * ns, dtype=object) # writers, open for the whole run
 # set header for met output
 header = ['year','month','pt','lap','tl','zl','pl','tu','zu','pu']
 for ist in range(0,ns,1): # loop for site
 	fname[ist] = 'pl5mon_' + str(df['site'][ist]) + '.csv' # set output file & header
-	with open(fname[ist], 'w', newline='') as f:
-		writer = csv.writer(f); writer.writerow(header)
+	fout[ist] = extract.Writer(fname[ist], header, 2)
 
 syr = 2010
 eyr = 2020
+arc = archive.Archive(src) if derive else None
 for iyr in range(syr,eyr+1,1):
-	nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + 'mon.nc')
+	if derive:
+		yms = [ym for ym in arc.months if ym[:4] == str(iyr)]
+		if len(yms) == 0: continue
+		nc = netCDF4.Dataset(arc.files(yms[0])[0])
+	else:
+		nc = netCDF4.Dataset(odir + '/' + site + str(iyr) + 'mon.nc')
 	# regional data lon:-180->180
-	nt = len(nc['date']) # t length
-	nx = len(nc['longitude']) # x length
-	ny = len(nc['latitude']) # y length
-	nz = len(nc['pressure_level']) # z length
-	dlon = nc['longitude'] # set lon array
-	dlat = nc['latitude'] # set lon array
 	dpl = nc['pressure_level']
-	dgx = abs(dlon[0]-dlon[1])
-	dgy = abs(dlat[0]-dlat[1])
-	lx = float(dlon[0]) - 0.5 * dgx # starting lon
-	uy = float(dlat[0]) + 0.5 * dgy # starting lat
+	g = extract.index(nc, pos) # site cells on this grid, cached per grid
 
-	for ist in range(0,ns,1):
-		if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]:
-			ix = int((slon[ist] - lx) / dgx)
-			iy = int((uy - slat[ist]) / dgy)
-			if ix < 0 or ix >= nx: sys.exit('out of domain for longitude')
-			if iy < 0 or iy >= ny: sys.exit('out of domain for latitude')
-			print(fname[ist],iyr,slon[ist],dlon[ix],slat[ist],dlat[iy],selv[ist])
-			with open(fname[ist], 'a', newline='') as f:
-				iz = 1
-				for it in range(0,nt,1):
-					izl = nz
-					while izl == nz:
-						if selv[ist] < nc['z'][it,iz,iy,ix] / 9.80665:
-							izu = iz
-							izl = izu - 1
-							if izl > 0 and selv[ist] < nc['z'][it,izl,iy,ix] / 9.80665:
-								print('level setting not enough low')
-							iz = iz - 2
-							if iz < 1: iz = 1
-						else: iz = iz + 1
-						if iz > nz and selv[ist] > nc['z'][it,iz,iy,ix] / 9.80665:
-							print('warning level not enough')
-							izu = nz
-							izl = izu - 1
-							iz = 1
-					tu = nc['t'][it,izu,iy,ix] - 273.15
-					zu = nc['z'][it,izu,iy,ix] / 9.80665
-					pu = nc['pressure_level'][izu]
-					tl = nc['t'][it,izl,iy,ix] - 273.15
-					zl = nc['z'][it,izl,iy,ix] / 9.80665
-					pl = nc['pressure_level'][izl]
-					lap = (tu - tl) / (zu - zl)
-					pt = lap * (selv[ist] - zl) + tl
-					var = np.array((iyr,it+1,pt,lap,tl,zl,pl,tu,zu,pu))
-					writer = csv.writer(f); writer.writerow(var)
+	act = np.array([ist for ist in range(0,ns,1) if iyr >= df['syr'][ist] and iyr <= df['eyr'][ist]]) # sites in period
+	if len(act) == 0: continue
+	out = act[~g['inside'].values[act]] # sites off this grid
+	if len(out): sys.exit('out of domain: ' + ' '.join(df['site'][out].astype(str)))
+	if derive: # means of the whole months of hourly profiles
+		mo, v = [], {'z': [], 't': []}
+		for ym in yms:
+			n, x = arc.mean(ym, ['z','t'], pos, act, how)
+			if n != extract.days(iyr, int(ym[4:])) * 24: print('incomplete month', ym, n, 'hours'); continue
+			mo.append(int(ym[4:])); v['z'].append(x['z']); v['t'].append(x['t'])
+		if len(mo) == 0: continue
+		mo, v = np.array(mo), {k: np.array(v[k]) for k in v}
+	else:
+		mo = extract.months(nc)[1] # months in the file
+		v = extract.sample(nc,['z','t'],pos,act,how) # (month, level, site) profiles of all sites
+	m = extract.bracket(v['z'],v['t'],dpl[:],selv.values[act])
+	h = np.stack([m[k] for k in extract.PL], axis=-1) # (month, site, var)
+	for j, ist in enumerate(act):
+		print(fname[ist],iyr,slon[ist],g['lon_era5'][ist],slat[ist],g['lat_era5'][ist],selv[ist])
+		if m['high'][j]: print('warning level not enough', m['high'][j], 'months')
+		fout[ist].write((iyr,mo), h[:,j])
+for ist in range(0,ns,1): fout[ist].close()
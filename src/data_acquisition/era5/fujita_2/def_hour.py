@@ -1,6 +1,15 @@
 import cdsapi
 # check pressure level (L133-) for the target domain
 latn, lats, lonw, lone = 55, 25, 65, 105 # for HMA
+LEVEL = [
+    "300", "350", "400",
+    "450", "500", "550",
+    "600", "650", "700",
+    "750", "775", "800",
+    "825", "850", "875",
+    "900", "925", "950",
+    "975", "1000"
+]
 
 def flx(site,iy,im):
     yr = str(iy)
@@ -130,15 +139,7 @@ def pl(site,iy,im):
             "18:00", "19:00", "20:00",
             "21:00", "22:00", "23:00"
         ],
-        "pressure_level": [
-            "300", "350", "400",
-            "450", "500", "550",
-            "600", "650", "700",
-            "750", "775", "800",
-            "825", "850", "875",
-            "900", "925", "950",
-            "975", "1000"
-        ],
+        "pressure_level": LEVEL,
         "data_format": "netcdf",
         "download_format": "unarchived",
         "area": [latn, lonw, lats, lone]
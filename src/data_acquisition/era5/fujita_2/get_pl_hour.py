@@ -1,11 +1,18 @@
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared kernels in era5/
+import def_hour
 from def_hour import *
+from pl_band import band
 
 site = 'pl'
 syr, eyr = 2000, 2024
 tm = 1 # restart month
 YY, MM = 1999, 3 # for single month retrieval
+subset = True # only the levels bracketing the sites in site.ini (see pl_band.py)
+
+if subset: def_hour.LEVEL = band('site.ini','surface_geopotential.nc',[latn,lonw,lats,lone],levels=def_hour.LEVEL)
+print('levels:', def_hour.LEVEL)
 
 os.makedirs(site, exist_ok=True)
 iy = syr
@@ -1,20 +1,23 @@
 import os
 import sys
+import def_hour
 from def_hour import *
+from pl_band import band
+from sched_hour import *
 
 site = 'pl'
 syr, eyr = 2000, 2024
-tm = 1 # restart month
+tm = 1 # restart month (reruns skip completed months via the ledger anyway)
+nw = 4 # month requests in flight (clipped at USER_CAP)
 YY, MM = 1999, 3 # for single month retrieval
+subset = True # only the levels bracketing the sites in site.ini (see pl_band.py)
 
-os.makedirs(site, exist_ok=True)
-iy = syr
-for im in range(tm,13,1):
-    pl(site,iy,im)
+if subset: def_hour.LEVEL = band('site.ini','surface_geopotential.nc')
+print('levels:', def_hour.LEVEL)
 
-for iy in range(syr+1,eyr+1,1):
-    for im in range(1,13,1):
-        pl(site,iy,im)
+os.makedirs(site, exist_ok=True)
+done, failed = run(jobs(site,['pl'],syr,eyr,tm), nw)
+print('failed months:', failed)
 
 sys.exit()
 iy, im = YY, MM
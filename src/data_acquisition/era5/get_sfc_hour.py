@@ -1,20 +1,17 @@
 import os
 import sys
 from def_hour import *
+from sched_hour import *
 
 site = 'harutori'
 syr, eyr = 1960, 1979
-tm = 1 # restart month
+tm = 1 # restart month (reruns skip completed months via the ledger anyway)
+nw = 4 # month requests in flight (clipped at USER_CAP)
 YY, MM = 1999, 3 # for single month retrieval
 
 # os.makedirs(site, exist_ok=True)
-iy = syr
-for im in range(tm,13,1):
-    sfc(site,iy,im)
-
-for iy in range(syr+1,eyr+1,1):
-    for im in range(1,13,1):
-        sfc(site,iy,im)
+done, failed = run(jobs(site,['sfc'],syr,eyr,tm), nw)
+print('failed months:', failed)
 
 sys.exit()
 
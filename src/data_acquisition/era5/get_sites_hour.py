@@ -0,0 +1,16 @@
+from def_hour import *
+from cluster import plan as boxes
+from plan_hour import *
+from sched_hour import *
+
+syr, eyr = 2000, 2025
+tm = 1 # restart month (reruns skip completed months anyway)
+nw = 4 # requests in flight (clipped at USER_CAP)
+
+# one tight box per cluster of sites in site.ini instead of one large domain
+jl = []
+for box in boxes('site.ini'):
+    print(box, area(box))
+    jl += plan(box,['flx','sfc'],syr,eyr,tm)
+done, failed = run(jl, nw)
+print('failed requests:', failed)
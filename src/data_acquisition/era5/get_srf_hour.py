@@ -0,0 +1,12 @@
+from def_hour import *
+from plan_hour import *
+from sched_hour import *
+
+site = 'harutori'
+syr, eyr = 2000, 2025
+tm = 1 # restart month (reruns skip completed months anyway)
+nw = 4 # requests in flight (clipped at USER_CAP)
+
+# flx and sfc together, consecutive months packed up to MAX_FIELDS per request
+done, failed = run(plan(site,['flx','sfc'],syr,eyr,tm), nw)
+print('failed requests:', failed)
@@ -0,0 +1,45 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+# SQLite ledger of def_hour retrievals, so that a restarted backfill reattaches to
+# jobs still queued/running at CDS and skips months already downloaded
+# state: submitted (job ID known), completed (target written), failed
+
+def phash(dataset, request, target=None): # parameters hash of a request and where it goes
+    s = json.dumps({'dataset': dataset, 'request': request, 'target': target}, sort_keys=True)
+    return hashlib.sha256(s.encode()).hexdigest()
+
+class Ledger:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''create table if not exists job (
+            hash text primary key, site text, prod text, year int, month int,
+            jid text, state text, target text, updated real)''')
+        self.db.commit()
+
+    def get(self, h): # row as dict, None if never submitted
+        with self.lock:
+            cur = self.db.execute('select * from job where hash = ?', (h,))
+            row = cur.fetchone()
+            if row is None: return None
+            return dict(zip([c[0] for c in cur.description], row))
+
+    def put(self, h, site, prod, iy, im, jid, state, target):
+        with self.lock:
+            self.db.execute('insert or replace into job values (?,?,?,?,?,?,?,?,?)',
+                            (h, site, prod, iy, im, jid, state, target, time.time()))
+            self.db.commit()
+
+    def rows(self, state=None): # all rows, or those in one state
+        with self.lock:
+            sql, arg = 'select * from job', ()
+            if state is not None: sql, arg = sql + ' where state = ?', (state,)
+            cur = self.db.execute(sql + ' order by year, month, prod', arg)
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import threading
+import time
+# one JSON line per retrieval in BASE_DIR/metrics.jsonl: queue wait, server processing,
+# download time, bytes and throughput; "python metrics.py report [log]" summarises them
+LOG = 'metrics.jsonl'
+_lock = threading.Lock()
+
+class Timer: # first time each job state was seen, filled while polling
+    def __init__(self):
+        self.t = {'submitted': time.time()}
+
+    def seen(self, state):
+        self.t.setdefault(state, time.time())
+
+    def mark(self, key, value=None):
+        self.t[key] = time.time() if value is None else value
+
+def record(path,timer,site,prods,iy,im,jid,state,reattached=False):
+    t = timer.t
+    done = t.get('successful', t.get(state, time.time()))
+    run = t.get('running', done) # a short job may never be seen running
+    nbyte = t.get('bytes', 0)
+    dl = t['downloaded'] - t['download'] if 'downloaded' in t else 0.0
+    rec = {'site': site, 'prod': prods, 'year': iy, 'month': im, 'jid': jid, 'state': state,
+           'submitted': t['submitted'], 'queue': run - t['submitted'], 'process': done - run,
+           'download': dl, 'bytes': nbyte, 'rate': nbyte / dl if dl > 0 else 0.0, 'reattached': reattached}
+    with _lock, open(path, 'a') as f: f.write(json.dumps(rec) + '\n')
+    return rec
+
+def load(path):
+    import pandas as pd
+    df = pd.read_json(path, lines=True)
+    df['reattached'] = df['reattached'].fillna(False).astype(bool) if 'reattached' in df else False
+    t = pd.to_datetime(df['submitted'], unit='s', utc=True)
+    days = ['Mon','Tue','Wed','Thu','Fri','Sat','Sun']
+    df['submit_month'] = t.dt.month
+    df['weekday'] = pd.Categorical(t.dt.day_name().str[:3], categories=days, ordered=True)
+    return df
+
+def report(path):
+    df = load(path)
+    agg = {'jid': 'count', 'queue': 'mean', 'process': 'mean', 'download': 'mean', 'bytes': 'sum', 'rate': 'mean'}
+    out = df[df['state'] == 'successful'].copy()
+    out.loc[out['reattached'], ['queue', 'process']] = float('nan') # states before a restart were not watched, left out of the means
+    out['bytes'] = out['bytes'] / 1e6 # MB
+    out['rate'] = out['rate'] / 1e6 # MB/s
+    print(f"{len(df)} retrievals, {(df['state'] != 'successful').sum()} failed, {df['reattached'].sum()} reattached")
+    for key in ('prod', 'submit_month', 'weekday'):
+        t = out.groupby(key, observed=True).agg(agg).rename(columns={'jid': 'n', 'bytes': 'MB', 'rate': 'MB/s'})
+        print(f'\nby {key} (seconds, MB)'); print(t.round(1).to_string())
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'report': sys.exit('usage: python metrics.py report [metrics.jsonl]')
+    import def_hour
+    report(sys.argv[2] if len(sys.argv) > 2 else os.path.join(def_hour.BASE_DIR, LOG))
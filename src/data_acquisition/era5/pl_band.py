@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import def_hour
+# smallest contiguous band of pressure levels that brackets every site of the domain
+# heights are the site elevations (site.ini) and the ERA5 surface (surface_geopotential.nc),
+# converted to pressure with the standard atmosphere and widened by MARGIN
+MARGIN = 50 # hPa on both sides, for weather and season
+G = 9.80665 # gravity
+
+def pressure(h): # standard atmosphere, height [m] -> pressure [hPa]
+    return 1013.25 * (1 - np.asarray(h) / 44330.8) ** (1 / 0.190263)
+
+def inside(df,area): # sites within [north, west, south, east]
+    latn, lonw, lats, lone = area
+    lon = np.where(df['lon'] > 180, df['lon'] - 360, df['lon']) # -180->180 as the regional files
+    return df[(df['lat'] <= latn) & (df['lat'] >= lats) & (lon >= lonw) & (lon <= lone)]
+
+def heights(ini='site.ini',geo='surface_geopotential.nc',area=None): # site and ERA5 surface heights [m]
+    import netCDF4
+    df = inside(pd.read_csv(ini), area or def_hour.area())
+    with netCDF4.Dataset(geo) as nc: # global data lon:0->360
+        dlon, dlat = nc['longitude'][:], nc['latitude'][:]
+        z = np.squeeze(nc['z'][:]) # (lat, lon)
+    dgx, dgy = abs(dlon[0]-dlon[1]), abs(dlat[0]-dlat[1])
+    lx, uy = float(dlon[0]) - 0.5 * dgx, float(dlat[0]) + 0.5 * dgy
+    xx = np.where(df['lon'] < 0, df['lon'] + 360, df['lon']) # replace west lon by east lon
+    ix = ((xx - lx) / dgx).astype(int) % len(dlon)
+    iy = ((uy - df['lat'].to_numpy()) / dgy).astype(int)
+    return np.concatenate([df['elv'].to_numpy(dtype=float), z[iy,ix] / G])
+
+def band(ini='site.ini',geo='surface_geopotential.nc',area=None,margin=MARGIN,levels=None):
+    levels = levels or def_hour.LEVEL
+    h = heights(ini,geo,area)
+    if len(h) == 0:
+        print('no site in the domain, all levels kept')
+        return levels
+    p = np.array([float(lev) for lev in levels])
+    pmax, pmin = pressure(h.min()) + margin, pressure(h.max()) - margin
+    lo = p[p >= pmax].min() if (p >= pmax).any() else p.max() # first level under the lowest site
+    hi = p[p <= pmin].max() if (p <= pmin).any() else p.min() # first level over the highest site
+    return [lev for lev, x in zip(levels, p) if hi <= x <= lo]
@@ -0,0 +1,139 @@
+import calendar
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+import cache
+import def_hour
+# coalesce products of the same dataset (flx + sfc) and consecutive months into
+# as few CDS jobs as the cost limit allows, then split each download back into
+# data/nc/<site>/<prod>/<site>_<YYYYMM>_<prod>_h.nc
+# a job is a dict: dataset, request, target (download) and parts [(site,prod,iy,im,fn)]
+MAX_FIELDS = 120000 # CDS cost limit of reanalysis-era5-*-levels (variables x levels x hours)
+TMP = 'tmp' # combined downloads under BASE_DIR/<site>/tmp, removed after splitting
+
+def single(site,prod,iy,im): # one product, one month: downloaded straight to its target
+    fn = def_hour.target(site,prod,iy,im)
+    return {'dataset': def_hour.DATASET[prod], 'request': def_hour.request(prod,iy,im,site=site),
+            'target': fn, 'parts': [(site,prod,iy,im,fn)]}
+
+def topup(site,prod,iy,im): # the days missing at the end of an existing month file, appended by split()
+    fn = def_hour.target(site,prod,iy,im)
+    n = cache.check(fn,def_hour.VARIABLE[prod],def_hour.area(site),def_hour.levels(prod))[1]
+    return {'dataset': def_hour.DATASET[prod], 'request': def_hour.request(prod,iy,im,n//24+1,site),
+            'target': fn + '.topup', 'parts': [(site,prod,iy,im,fn)], 'topup': True}
+
+def request(prods,iy,ims,site=None): # one request for several products and complete months of a year
+    request = def_hour.request(prods[0],iy,ims[0],site=site)
+    request["variable"] = [v for prod in prods for v in def_hour.VARIABLE[prod]]
+    request["month"] = [f'{im:02d}' for im in ims]
+    request["day"] = def_hour.DAY # CDS skips the days a month does not have
+    if len(prods) > 1: request["download_format"] = "zip" # accumulated and instant fields come in separate files
+    return request
+
+def fields(request): # cost of a request in fields
+    nlev = len(request.get("pressure_level", [None]))
+    iy, ims = int(request["year"]), [int(mn) for mn in request["month"]]
+    nday = sum(len([d for d in request["day"] if int(d) <= calendar.monthrange(iy,im)[1]]) for im in ims)
+    return len(request["variable"]) * nlev * nday * len(request["time"])
+
+def merged(site,prods,iy,ims):
+    if len(prods) == 1 and len(ims) == 1: return single(site,prods[0],iy,ims[0])
+    name = f"{site}_{iy}{ims[0]:02d}-{ims[-1]:02d}_{'+'.join(prods)}"
+    req = request(prods,iy,ims,site)
+    ext = '.zip' if req["download_format"] == "zip" else '.nc'
+    return {'dataset': def_hour.DATASET[prods[0]], 'request': req,
+            'target': os.path.join(def_hour.BASE_DIR, site, TMP, name + ext),
+            'parts': [(site,prod,iy,im,def_hour.target(site,prod,iy,im)) for im in ims for prod in prods]}
+
+def state(site,prod,iy,im): # cache state of a month file: skip, repair, topup or fetch
+    fn = def_hour.target(site,prod,iy,im)
+    book = cache.manifest(def_hour.BASE_DIR)
+    return cache.state(book,fn,def_hour.VARIABLE[prod],cache.nhour(iy,im),def_hour.area(site),def_hour.levels(prod))
+
+def plan(site,prods,syr,eyr,tm=1,em=12,limit=MAX_FIELDS): # jobs for the missing months of prods
+    groups = {} # products sharing a dataset go together
+    for prod in prods: groups.setdefault(def_hour.DATASET[prod], []).append(prod)
+    jobs = []
+    for group in groups.values():
+        if len(group) > 1 and fields(request(group,syr,[1],site)) > limit: # too large together even for a month
+            for prod in group: jobs += plan(site,[prod],syr,eyr,tm,em,limit)
+            continue
+        for iy in range(syr,eyr+1,1):
+            ims = []
+            for im in range(1,13,1):
+                if not (syr,tm) <= (iy,im) <= (eyr,em) or cache.nday(iy,im) == 0: continue
+                states = [state(site,prod,iy,im) for prod in group]
+                if cache.nday(iy,im) < calendar.monthrange(iy,im)[1] or 'topup' in states: # month still growing
+                    jobs += [single(site,prod,iy,im) for prod, st in zip(group,states) if st in ('fetch','topup')]
+                elif 'fetch' in states:
+                    ims.append(im)
+            run = []
+            for im in ims: # pack consecutive months up to the limit
+                if run and (im != run[-1] + 1 or fields(request(group,iy,run + [im],site)) > limit):
+                    jobs.append(merged(site,group,iy,run)); run = []
+                run.append(im)
+            if run: jobs.append(merged(site,group,iy,run))
+    return jobs
+
+def members(fn,tmp): # netcdf files of a download, unpacking zip archives into tmp
+    if not zipfile.is_zipfile(fn): return [fn]
+    with zipfile.ZipFile(fn) as z:
+        return [z.extract(m, tmp) for m in z.namelist() if m.endswith('.nc')]
+
+def copy(src,dst,names,it,grow=False): # grow: unlimited valid_time, so that top-ups append in place
+    dst.setncatts({a: src.getncattr(a) for a in src.ncattrs()})
+    for d in src.dimensions:
+        if d in dst.dimensions: continue
+        if d == 'valid_time': dst.createDimension(d, None if grow else len(it))
+        else: dst.createDimension(d, len(src.dimensions[d]))
+    for name, v in src.variables.items():
+        if name not in names and name not in src.dimensions: continue
+        if name in dst.variables: continue
+        out = dst.createVariable(name, v.dtype, v.dimensions, zlib=name not in src.dimensions,
+                                 fill_value=getattr(v, '_FillValue', None))
+        out.setncatts({a: v.getncattr(a) for a in v.ncattrs() if a != '_FillValue'})
+        out[:] = v[it] if v.dimensions[:1] == ('valid_time',) else v[:]
+
+def append(fn,new): # add the hours of the file new at the end of the month file fn
+    import netCDF4
+    with cache.nclock:
+        with netCDF4.Dataset(fn) as old: grow = old.dimensions['valid_time'].isunlimited()
+        if not grow: # rewrite once with an unlimited time axis
+            with netCDF4.Dataset(fn) as old, netCDF4.Dataset(fn + '.part', 'w') as dst:
+                copy(old,dst,list(old.variables),np.arange(len(old['valid_time'])),grow=True)
+            os.replace(fn + '.part', fn)
+        with netCDF4.Dataset(fn, 'a') as dst, netCDF4.Dataset(new) as src:
+            n, m = len(dst['valid_time']), len(src['valid_time'])
+            for name, v in src.variables.items():
+                if name in dst.variables and v.dimensions[:1] == ('valid_time',): dst[name][n:n+m] = v[:]
+
+def split(job): # write the per-month, per-product files of a combined download
+    import netCDF4
+    if job.get('topup'):
+        append(job['parts'][0][4], job['target'])
+        os.remove(job['target'])
+        return
+    if len(job['parts']) == 1 and job['parts'][0][4] == job['target']: return
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(job['target']))
+    try:
+        with cache.nclock:
+            srcs = [netCDF4.Dataset(fn) for fn in members(job['target'],tmp)]
+            try:
+                for site, prod, iy, im, fn in job['parts']:
+                    names = [cache.NAME[v] for v in def_hour.VARIABLE[prod]]
+                    os.makedirs(os.path.dirname(fn), exist_ok=True)
+                    with netCDF4.Dataset(fn + '.part', 'w') as dst:
+                        for src in srcs:
+                            if not any(n in src.variables for n in names): continue
+                            vt = src['valid_time']
+                            t = netCDF4.num2date(vt[:], vt.units, getattr(vt, 'calendar', 'standard'))
+                            it = np.array([d.year == iy and d.month == im for d in t])
+                            copy(src,dst,names,np.where(it)[0])
+                    os.replace(fn + '.part', fn)
+            finally:
+                for src in srcs: src.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    os.remove(job['target'])
@@ -0,0 +1,102 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import cache
+import cds
+import def_hour
+import metrics
+import plan_hour
+from ledger import Ledger, phash
+# keep several month requests in flight instead of waiting in the CDS queue one by one
+# months with a valid file on disk (see cache.py) are never submitted, and every job is
+# recorded in the ledger (BASE_DIR/ledger.sqlite): a rerun reattaches to jobs still
+# queued or running at CDS
+USER_CAP = 4 # max. requests queued/running at CDS per user
+LEDGER = 'ledger.sqlite' # file name under def_hour.BASE_DIR
+_lock = threading.Lock()
+_slots = {} # per-user semaphore shared by all runs in this process
+
+def slot(client): # semaphore of the user behind the client
+    key = getattr(client, 'key', None)
+    with _lock:
+        if key not in _slots: _slots[key] = threading.BoundedSemaphore(USER_CAP)
+        return _slots[key]
+
+def jobs(site,prods,syr,eyr,tm=1,em=12): # one job per product and month, from restart month tm to end month em
+    return [plan_hour.single(site,prod,iy,im) for iy in range(syr,eyr+1,1) for im in range(1,13,1)
+            if (syr,tm) <= (iy,im) <= (eyr,em) and cache.nday(iy,im) > 0 for prod in prods]
+
+def label(job): # (site,prods,year,month) of the first month, for printing and the ledger
+    site, prod, iy, im, fn = job['parts'][0]
+    prods = '+'.join(dict.fromkeys(p[1] for p in job['parts']))
+    return site, prods, iy, im
+
+def todo(job): # the job to submit (tail days for a top-up), None if valid copies are on disk
+    files = cache.manifest(def_hour.BASE_DIR)
+    states = [cache.state(files,fn,def_hour.VARIABLE[prod],cache.nhour(iy,im),def_hour.area(site),def_hour.levels(prod))
+              for site, prod, iy, im, fn in job['parts']]
+    if 'fetch' not in states and 'topup' not in states: return None
+    if states == ['topup']: return plan_hour.topup(*job['parts'][0][:4])
+    return job
+
+def finish(job): # split the download into month files and record them in the manifest
+    files = cache.manifest(def_hour.BASE_DIR)
+    plan_hour.split(job)
+    for site, prod, iy, im, fn in job['parts']:
+        cache.accept(files,fn,def_hour.VARIABLE[prod],cache.nhour(iy,im),def_hour.area(site),def_hour.levels(prod))
+
+def reattach(state): # True if a submitted job is still usable at CDS
+    return state in cds.PENDING + ('successful',)
+
+def fetch(job,client,book,poll=cds.POLL): # returns the month files of the job
+    out = [p[4] for p in job['parts']]
+    job = todo(job)
+    if job is None: return out
+    site, prods, iy, im = label(job)
+    dataset, request, fn = job['dataset'], job['request'], job['target']
+    h = phash(dataset, request, fn)
+    row = book.get(h)
+    log = os.path.join(def_hour.BASE_DIR, metrics.LOG)
+    with slot(client):
+        jid, timer = None, metrics.Timer()
+        if row is not None and row['state'] == 'submitted' and reattach(client.status(row['jid'])):
+            jid = row['jid']
+            timer.mark('submitted', row['updated']) # when the ledger recorded the submission, before the restart
+            print('reattach',site,prods,iy,f'{im:02d}',jid)
+        if jid is None:
+            n = len(job['parts'])
+            print(site,prods,iy,f'{im:02d}',f'({n} files)' if n > 1 else 'topup' if job.get('topup') else '')
+            jid = client.submit(dataset, request)
+            book.put(h,site,prods,iy,im,jid,'submitted',fn)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        again = jid == (row or {}).get('jid')
+        try:
+            cds.wait_download(client, jid, fn, poll, timer)
+            finish(job)
+        except Exception:
+            book.put(h,site,prods,iy,im,jid,'failed',fn)
+            metrics.record(log,timer,site,prods,iy,im,jid,'failed',again)
+            raise
+        book.put(h,site,prods,iy,im,jid,'completed',fn)
+        metrics.record(log,timer,site,prods,iy,im,jid,'successful',again)
+    return out
+
+def run(jobs,nw=USER_CAP,client=None,db=None,poll=cds.POLL): # nw: requests in flight, clipped at USER_CAP
+    nw = max(1, min(nw, USER_CAP))
+    if client is None: client = cds.Client()
+    if db is None:
+        os.makedirs(def_hour.BASE_DIR, exist_ok=True)
+        db = os.path.join(def_hour.BASE_DIR, LEDGER)
+    book = Ledger(db)
+    done, failed = [], []
+    with ThreadPoolExecutor(max_workers=nw) as ex:
+        fs = {ex.submit(fetch, job, client, book, poll): job for job in jobs}
+        for f in as_completed(fs): # collect months as they finish
+            job = fs[f]
+            try:
+                done += f.result()
+            except Exception as e:
+                print('failed', *label(job), e)
+                failed.append(label(job))
+    book.close()
+    return done, failed